@@ -1,21 +1,34 @@
 import importlib
-import json
 import os
 import sys
 from threading import Thread
 from typing import *
 
 from kivy.app import App as KivyApp
+from kivy.clock import Clock
 from kivy.config import ConfigParser
 from kivy.lang.builder import Builder
 from kivy.logger import Logger
 from kivy.uix.screenmanager import ScreenManager
 
-from aiventure.common.ai import AI
 from aiventure.common.adventure import Adventure
-from aiventure.client.uix.menu import MenuScreen
-from aiventure.client.uix.play import PlayScreen
-from aiventure.common.utils import get_save_name, is_model_valid
+from aiventure.common.journal import Journal
+from aiventure.common.metrics import MetricsLog
+from aiventure.common.modules import ModuleRegistry
+from aiventure.common.pipeline import FilterPipeline
+from aiventure.common.prompts import PromptLibrary
+from aiventure.common.saves import SaveIndex
+from aiventure.common.stopping import StoppingCriterion
+from aiventure.common.vocabulary import Vocabulary
+from aiventure.common.pool import ModelPool
+from aiventure.common.utils import get_model_file_size, get_save_name, is_model_valid
+
+if TYPE_CHECKING:
+    # torch and transformers are only imported once a model is loaded
+    from aiventure.common.backend import Backend
+
+# Modules which take longer than this to import, in milliseconds, are warned about
+slow_import_ms = 100.0
 
 
 class App(KivyApp):
@@ -25,21 +38,32 @@ class App(KivyApp):
         # UI
         self.title: str = 'Aiventure'
         self.sm: Optional[ScreenManager] = None
-        self.screens: Dict[str, ClassVar] = {}
+        self.screens: Dict[str, str] = {}
         # AI
-        self.ai: Optional[AI] = None
+        self.ai: Optional['Backend'] = None
+        # The name of the current model
+        self.model: Optional[str] = None
+        self.models: ModelPool = ModelPool()
+        self.prompts: Optional[PromptLibrary] = None
         self.adventure: Optional[Adventure] = None
+        self.journal: Optional[Journal] = None
+        self.saves: Optional[SaveIndex] = None
+        self.metrics: Optional[MetricsLog] = None
         # Threading
         self.threads: Dict[str, Thread] = {}
         # Modules
-        self.loaded_modules: Dict[str, str] = {}
-        self.input_filters: List[Callable[[str], str]] = []
-        self.output_filters: List[Callable[[str], str]] = []
-        self.display_filter: Optional[Callable[[List[str]], str]] = None
+        self.modules: ModuleRegistry = ModuleRegistry()
+        # The filters resolved from the modules, and the version of the modules they were resolved from
+        self.filters: Dict[str, Any] = {}
+        self.filters_version: int = -1
 
     def build(self) -> ScreenManager:
         """
         """
+        self.models.budget = self.config.getint('ai', 'model_memory') * 1024 * 1024
+        self.saves = SaveIndex(self.get_user_path('adventures'))
+        self.init_prompts()
+        self.init_metrics()
         self.init_mods()
         self.init_ui()
         return self.sm
@@ -51,12 +75,26 @@ class App(KivyApp):
         self.config.read('config.ini')
         self.config.setdefaults('general', {
             'userdir': 'user',
-            'autosave': True
+            'autosave': True,
+            'metrics': True,
+            'debug_overlay': False,
+            'reload_modules': True
         })
         self.config.setdefaults('ai', {
+            'server': '',
+            'precision': 'auto',
+            'model_memory': 2048,
             'timeout': 20.0,
             'memory': 20,
+            'token_budget': 0,
             'max_length': 60,
+            'candidates': 1,
+            'speculate': False,
+            'summarize': False,
+            'summary_length': 80,
+            'recall': 3,
+            'recall_tokens': 150,
+            'prompt_snapshots': True,
             'beam_searches': 1,
             'temperature': 0.8,
             'top_k': 40,
@@ -66,40 +104,199 @@ class App(KivyApp):
         self.config.setdefaults('modules', {
             'input_filters': 'aiventure:filters',
             'output_filters': 'aiventure:filters',
-            'display_filter': 'aiventure:filters'
+            'display_filter': 'aiventure:filters',
+            'stopping_criteria': 'aiventure:stopping',
+            'vocabulary': 'aiventure:vocabulary'
         })
         self.config.write()
 
+    def on_config_change(self, config: ConfigParser, section: str, key: str, value: Any) -> None:
+        """
+        Applies configuration changes which take effect immediately.
+        """
+        if section == 'ai' and key == 'model_memory':
+            self.models.budget = int(float(value)) * 1024 * 1024
+            self.models.evict_to_fit(0)
+        elif section == 'general' and key == 'metrics':
+            self.init_metrics()
+
+    def on_stop(self) -> None:
+        """
+        Logs the time taken by each filter, to find the ones slowing down every turn.
+        """
+        for pipeline in (self.filters.get('input'), self.filters.get('output')):
+            for name, calls, mean in pipeline.stats if pipeline else []:
+                Logger.info(f'Modules: {name} took {mean:.3f} ms on average over {calls} calls')
+
     def init_mods(self) -> None:
         """
-        Initializes the game's module system and loads mods based on the current configuration.
+        Initializes the game's module system. Modules are only imported once their filters are first used, and
+        are reloaded when their files change if the reload modules setting is set to `True`.
         """
         sys.path.append(self.config.get('general', 'userdir'))
+        Clock.schedule_interval(lambda dt: self.reload_mods(), 1.0)
+
+    def reload_mods(self) -> None:
+        """
+        Reloads the loaded modules whose files have changed, if the reload modules setting is set to `True`.
+        The filters are resolved again the next time they are used.
+        """
+        if not self.config.getboolean('general', 'reload_modules'):
+            return
+        for key, error in self.modules.reload_changed().items():
+            if error is None:
+                Logger.info(f'Modules: Reloaded {key} in {self.modules.import_times[key]:.1f} ms')
+            else:
+                Logger.error(f'Modules: Could not reload {key}, keeping the previous version: {error}')
+
+    def get_filters(self) -> Dict[str, Any]:
+        """
+        Resolves the filters from the modules in the current configuration, the first time they are needed and
+        again after a module is reloaded. The time taken by each filter so far is kept.
+
+        :return: The input filters (`input`), output filters (`output`), display filter (`display`), the
+        optional display filter for single entries (`display_entry`), the stopping criteria (`stopping`) and the
+        vocabulary of all of the modules combined (`vocabulary`).
+        """
+        with self.modules.lock:
+            if self.filters_version == self.modules.version:
+                return self.filters
+            version = self.modules.version
+            filters = {'input': FilterPipeline(), 'output': FilterPipeline()}
+            for kind in ('input', 'output'):
+                for f in self.config.get('modules', f'{kind}_filters').split(','):
+                    domain, module = f.split(':')
+                    filters[kind].add_filter(f'{f}.filter_{kind}', self.load_module(domain, module), f'filter_{kind}')
+                old = self.filters.get(kind)
+                if old is not None:
+                    filters[kind].times.update((n, t) for n, t in old.times.items() if n in filters[kind].times)
+            domain, module = self.config.get('modules', 'display_filter').split(':')
+            filters['display'] = self.load_submodule(domain, module, 'filter_display')
+            # optional, lets the display be rendered incrementally
+            filters['display_entry'] = getattr(self.load_module(domain, module), 'filter_display_entry', None)
+            filters['stopping'] = []
+            for f in filter(None, self.config.get('modules', 'stopping_criteria').split(',')):
+                domain, module = f.split(':')
+                filters['stopping'] += self.load_submodule(domain, module, 'stopping_criteria')
+            filters['vocabulary'] = Vocabulary()
+            for f in filter(None, self.config.get('modules', 'vocabulary').split(',')):
+                domain, module = f.split(':')
+                m = self.load_module(domain, module)
+                filters['vocabulary'] += Vocabulary(
+                    getattr(m, 'vocabulary_biases', None), getattr(m, 'vocabulary_bans', None)
+                )
+            self.filters, self.filters_version = filters, version
+            return filters
+
+    @property
+    def input_filters(self) -> FilterPipeline:
+        return self.get_filters()['input']
+
+    @property
+    def output_filters(self) -> FilterPipeline:
+        return self.get_filters()['output']
+
+    @property
+    def display_filter(self) -> Callable[[List[str]], str]:
+        return self.get_filters()['display']
+
+    @property
+    def display_entry_filter(self) -> Optional[Callable[[str, int, Optional[str]], str]]:
+        return self.get_filters()['display_entry']
+
+    @property
+    def stopping_criteria(self) -> List[StoppingCriterion]:
+        return self.get_filters()['stopping']
+
+    @property
+    def vocabulary(self) -> Vocabulary:
+        return self.get_filters()['vocabulary']
+
+    def init_metrics(self) -> None:
+        """
+        Opens the metrics log, at {userdir}/metrics.jsonl and {userdir}/metrics.prom, if the metrics setting is set
+        to `True`, and closes it otherwise.
+        """
+        if self.config.getboolean('general', 'metrics'):
+            if self.metrics is None:
+                self.metrics = MetricsLog(self.get_user_path('metrics'))
+        else:
+            self.metrics = None
+
+    def init_prompts(self) -> None:
+        """
+        Initializes the library of scenario templates in {userdir}/prompts. They are only loaded by `load_prompts`.
+        """
+        self.prompts = PromptLibrary(self.get_user_path('prompts'))
 
-        for f in self.config.get('modules', 'input_filters').split(','):
-            domain, module = f.split(':')
-            Logger.info(f'Modules: Loading {f}.filter_input')
-            self.input_filters += [self.load_submodule(domain, module, 'filter_input')]
+    def load_prompts(self) -> None:
+        """
+        Loads the scenario templates again, picking up the ones which were added or changed.
+        """
+        for file, error in self.prompts.load().items():
+            Logger.error(f'Prompts: Could not load "{file}": {error}')
 
-        for f in self.config.get('modules', 'output_filters').split(','):
-            domain, module = f.split(':')
-            Logger.info(f'Modules: Loading {f}.filter_output')
-            self.output_filters += [self.load_submodule(domain, module, 'filter_output')]
+    def prepare_prompts(self) -> None:
+        """
+        Saves snapshots of the current model's key/value states for the context of every scenario template which
+        doesn't have an up to date one, in the background, if the prompt snapshots setting is set to `True`.
+        """
+        if self.ai is None or self.is_remote_model(self.model) \
+                or not self.config.getboolean('ai', 'prompt_snapshots'):
+            return
+        self.threads['prompts'] = Thread(target=self._prepare_prompts_thread, args=(self.ai, self.model), daemon=True)
+        self.threads['prompts'].start()
 
-        domain, module = self.config.get('modules', 'display_filter').split(':')
-        Logger.info(f'Modules: Loading {f}.filter_display')
-        self.display_filter = self.load_submodule(domain, module, 'filter_display')
+    def _prepare_prompts_thread(self, ai: 'Backend', model: str) -> None:
+        """
+        Internal thread for saving the snapshots of the scenario templates so that the main thread isn't blocked.
+
+        :param ai: The model to save the snapshots of.
+        :param model: The name of the model.
+        """
+        try:
+            for file in self.prompts.prepare(ai, model):
+                Logger.info(f'Prompts: Saved the context of "{file}" for {model} in {ai.precision} precision')
+        except Exception as e:
+            Logger.error(f'Prompts: Could not save the contexts for {model}: {e}')
+
+    def prime_prompt(self, context: str) -> None:
+        """
+        Loads the current model's key/value states for a context, if it is the context of a scenario template with
+        an up to date snapshot, so the first turn of a new adventure doesn't have to prefill it.
+
+        :param context: The context of the new adventure.
+        """
+        if self.ai is None or self.is_remote_model(self.model) \
+                or not self.config.getboolean('ai', 'prompt_snapshots'):
+            return
+        if self.prompts.prime(self.ai, self.model, context):
+            Logger.info(f'Prompts: Loaded the context of "{self.prompts.find(context)}" for {self.model}')
 
     def init_ui(self) -> None:
         """
-        Initializes the screen manager, loads all screen kivy files and their associated python modules.
+        Initializes the screen manager and shows the main menu. Screens are only built when they are first shown.
         """
         self.sm = ScreenManager()
-        self.screens = {'menu': MenuScreen, 'play': PlayScreen }
-        for n, s in self.screens.items():
-            Builder.load_file(f'aiventure/client/uix/{n}.kv')
-            self.sm.add_widget(s(name=n))
-        self.sm.current = 'menu'
+        self.screens = {
+            'menu': 'aiventure.client.uix.menu:MenuScreen',
+            'play': 'aiventure.client.uix.play:PlayScreen',
+        }
+        self.show_screen('menu')
+
+    def show_screen(self, name: str) -> None:
+        """
+        Switches to a screen, loading its kivy file and python module and building it first if it hasn't been shown
+        before.
+
+        :param name: The name of the screen to show.
+        """
+        if not self.sm.has_screen(name):
+            module, cls = self.screens[name].split(':')
+            Builder.load_file(f'aiventure/client/uix/{name}.kv')
+            screen = getattr(importlib.import_module(module), cls)
+            self.sm.add_widget(screen(name=name))
+        self.sm.current = name
 
     def get_user_path(self, *args: str) -> str:
         """
@@ -119,28 +316,74 @@ class App(KivyApp):
         """
         return self.get_user_path('models', model)
 
+    def load_model(self, model: str) -> 'Backend':
+        """
+        Loads an AI model, or reuses it if it is still in the model pool, and makes it the current model.
+        Least recently used models are evicted from the pool to stay within the model memory budget.
+
+        :param model: The model within the models subdirectory, or the URL of an aiventure server.
+        :return: The loaded model.
+        """
+        self.ai = None
+        self.model = model
+        if self.is_remote_model(model):
+            from aiventure.common.remote import RemoteBackend
+            self.ai = self.models.get(model, lambda: RemoteBackend(model))
+            return self.ai
+        from aiventure.common.ai import AI
+        model_path = self.get_model_path(model)
+        precision = self.config.get('ai', 'precision')
+        self.ai = self.models.get(
+            model_path,
+            lambda: AI(model_path, precision=precision),
+            size_hint=get_model_file_size(model_path),
+            valid=lambda ai: precision in ('auto', ai.precision),
+        )
+        for k, v in self.models.sizes.items():
+            Logger.info(f'AI: Model at "{k}" is using {v / (1024 * 1024):.1f} MB')
+        self.prepare_prompts()
+        return self.ai
+
     def get_valid_models(self) -> List[str]:
         """
-        :return: A list of valid model names, inside {userdir}/models
+        :return: A list of valid model names, inside {userdir}/models, followed by the configured server's URL
+        if there is one.
         """
-        return [m.name for m in os.scandir(self.get_user_path('models')) if is_model_valid(m.path)]
+        models = [m.name for m in os.scandir(self.get_user_path('models')) if is_model_valid(m.path)]
+        server = self.config.get('ai', 'server').strip()
+        if server and not self.is_remote_model(server):
+            server = f'http://{server}'
+        return models + ([server] if server else [])
+
+    @staticmethod
+    def is_remote_model(model: str) -> bool:
+        """
+        :param model: The model name, as returned by `get_valid_models`.
+        :return: `True` if the model is served by an aiventure server, `False` if it is a local model.
+        """
+        return '://' in model
 
     def get_module_path(self, domain: str, module: str) -> str:
         return self.get_user_path('modules', domain, f'{module}.py')
 
     def load_module(self, domain: str, module: str) -> Any:
         """
-        Loads a module and returns it (if it hasn't been loaded already).
+        Loads a module and returns it (if it hasn't been loaded already). Modules which take long to import are
+        warned about, since they slow down the first turn.
 
         :param domain: The module domain.
         :param module: The module to load from the given domain.
         :return: The loaded module.
         """
         k = f'{domain}:{module}'
-        v = self.loaded_modules.get(k)
-        if v is None:
-            v = importlib.import_module(f'.{module}', f'modules.{domain}')
-            self.loaded_modules[k] = v
+        if k in self.modules.modules:
+            return self.modules.get(k)
+        v = self.modules.get(k)
+        import_time = self.modules.import_times[k]
+        if import_time > slow_import_ms:
+            Logger.warning(f'Modules: Importing {k} took {import_time:.1f} ms')
+        else:
+            Logger.info(f'Modules: Imported {k} in {import_time:.1f} ms')
         return v
 
     def load_submodule(self, domain: str, module: str, submodule: str) -> str:
@@ -159,16 +402,23 @@ class App(KivyApp):
 
     def save_adventure(self) -> None:
         """
-        Saves the current adventure.
+        Saves the current adventure, only appending the changes made since it was last saved to its journal.
         """
-        savefile = get_save_name(self.adventure.name)
-        with open(self.get_user_path('adventures', f'{savefile}.json'), 'w') as json_file:
-            json.dump(self.adventure.to_dict(), json_file, indent=4)
+        journal = self.get_journal()
+        journal.save(self.adventure)
+        self.saves.update(os.path.basename(journal.path), self.adventure)
 
     def load_adventure(self) -> None:
         """
         Loads the current adventure.
         """
-        savefile = get_save_name(self.adventure.name)
-        with open(self.get_user_path('adventures', f'{savefile}.json'), 'r') as json_file:
-            self.adventure.from_dict(json.load(json_file))
+        self.get_journal().load(self.adventure)
+
+    def get_journal(self) -> Journal:
+        """
+        :return: The journal the current adventure is saved to.
+        """
+        path = self.get_user_path('adventures', get_save_name(self.adventure.name))
+        if self.journal is None or self.journal.path != path:
+            self.journal = Journal(path)
+        return self.journal
@@ -1,7 +1,7 @@
 from typing import *
-import json
 import threading
 
+from kivy.clock import Clock
 from kivy.input import MotionEvent
 from kivy.logger import Logger
 from kivy.properties import BooleanProperty
@@ -13,7 +13,6 @@ from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.screenmanager import Screen
 from kivy.uix.settings import SettingsWithTabbedPanel
 
-from aiventure.common.ai import AI
 from aiventure.common.adventure import Adventure
 from aiventure.client.utils import init_widget
 from aiventure.common.utils import *
@@ -95,6 +94,16 @@ class SelectableGameLabel(SelectableLabel):
             self.screen.on_game_selected(self.text)
 
 
+class SelectablePromptLabel(SelectableLabel):
+    """
+    Specific implementation of SelectableLabel for the scenario templates in the new game menu.
+    """
+    def apply_selection(self, rv, index, is_selected) -> None:
+        super(SelectablePromptLabel, self).apply_selection(rv, index, is_selected)
+        if is_selected:
+            self.screen.on_prompt_selected(self.text)
+
+
 class MenuScreen(Screen):
     """
     The main menu screen.
@@ -103,16 +112,21 @@ class MenuScreen(Screen):
         super().__init__(**kwargs)
         from aiventure.client.app import App
         self.app: App = App.get_running_app()
+        # The metadata of each save, keyed by the adventure's name
         self.savefiles: Dict[str, Dict[str, Any]] = {}
+        # The file of each scenario template, keyed by the template's name
+        self.promptfiles: Dict[str, str] = {}
         self.selected_model: Optional[str] = None
         self.selected_savefile: Optional[str] = None
-        self.init_settings()
+        self.settings: Optional[SettingsWithTabbedPanel] = None
 
     def init_settings(self) -> None:
         """
-        Initializes the settings tab  using the default kivy implementation.
+        Initializes the settings tab using the default kivy implementation, the first time it is opened.
         """
-        settings = SettingsWithTabbedPanel()
+        if self.settings:
+            return
+        self.settings = settings = SettingsWithTabbedPanel()
         # this is to remove the unecessary close button
         settings.children[0].remove_widget(settings.children[0].children[0])
         settings.add_json_panel('General', self.app.config, 'aiventure/client/uix/settings/general.json')
@@ -125,6 +139,7 @@ class MenuScreen(Screen):
         """
         self.app.adventure = Adventure()
         self.init_models()
+        self.init_prompts()
         self.init_saves()
         self.update_button_start_new()
         self.update_button_start_load()
@@ -177,8 +192,7 @@ class MenuScreen(Screen):
         try:
             self.update_status_text(f'Loading Model "{model_name}"')
             Logger.info(f'AI: Loading model at "{model_path}"')
-            self.app.ai = None
-            self.app.ai = AI(model_path)
+            self.app.load_model(self.selected_model)
             Logger.info(f'AI: Model loaded at "{model_path}"')
         except Exception as e:
             self.app.ai = None
@@ -191,6 +205,25 @@ class MenuScreen(Screen):
     NEW GAME TAB
     """
 
+    def init_prompts(self) -> None:
+        """
+        Fetches the scenario templates available for starting a new game from.
+        """
+        self.app.load_prompts()
+        self.promptfiles = {p.name: file for file, p in self.app.prompts.prompts.items()}
+        self.ids.view_prompt.data = [{'text': str(p)} for p in self.promptfiles.keys()]
+
+    def on_prompt_selected(self, name: str) -> None:
+        """
+        Fills in the new game from a scenario template.
+
+        :param name: The name of the template.
+        """
+        prompt = self.app.prompts.prompts[self.promptfiles[name]]
+        self.ids.input_name.text = prompt.name
+        self.ids.input_context.text = prompt.context
+        self.ids.input_prompt.text = prompt.prompt
+
     def on_start_new(self) -> None:
         """
         Starts a new game and goes to the in-game screen.
@@ -198,7 +231,8 @@ class MenuScreen(Screen):
         self.app.adventure.name = self.ids.input_name.text
         self.app.adventure.context = self.ids.input_context.text
         self.app.adventure.actions.append(self.ids.input_prompt.text)
-        self.app.sm.current = 'play'
+        self.app.prime_prompt(self.app.adventure.context)
+        self.app.show_screen('play')
 
     def update_button_start_new(self) -> None:
         """
@@ -217,15 +251,31 @@ class MenuScreen(Screen):
 
     def init_saves(self) -> None:
         """
-        Fetches and loads all the game saves in the user directory for selection.
+        Lists the game saves in the user directory for selection, as they were when they were last indexed, then
+        brings the list up to date in the background.
         """
-        paths = [s.path for s in os.scandir(self.app.get_user_path('adventures')) if s.path.endswith('.json')]
-        for p in paths:
-            with open(p, 'r') as json_file:
-                data = json.load(json_file)
-                self.savefiles[data['name']] = data
-        self.ids.view_game.data = [{'text': str(s)} for s in self.savefiles.keys()]
         self.selected_savefile = None
+        self.show_saves(self.app.saves.get_entries())
+        threading.Thread(target=self._scan_saves_thread, daemon=True).start()
+
+    def show_saves(self, saves: List[Dict[str, Any]]) -> None:
+        """
+        Shows the given game saves for selection.
+
+        :param saves: The metadata of each save, as kept by the save index.
+        """
+        self.savefiles = {s['name']: s for s in saves}
+        self.ids.view_game.data = [{'text': str(s)} for s in self.savefiles.keys()]
+        if self.selected_savefile not in self.savefiles:
+            self.selected_savefile = None
+            self.update_button_start_load()
+
+    def _scan_saves_thread(self) -> None:
+        """
+        Internal thread for checking the save index against the saves so that the main thread isn't blocked.
+        """
+        saves = self.app.saves.scan()
+        Clock.schedule_once(lambda dt: self.show_saves(saves))
 
     def on_game_selected(self, game) -> None:
         """
@@ -240,8 +290,9 @@ class MenuScreen(Screen):
         """
         Starts a game from a save and goes to the in-game screen.
         """
-        self.app.adventure.from_dict(self.savefiles[self.selected_savefile])
-        self.app.sm.current = 'play'
+        self.app.adventure.name = self.savefiles[self.selected_savefile]['name']
+        self.app.load_adventure()
+        self.app.show_screen('play')
 
     def update_button_start_load(self) -> None:
         """
@@ -1,22 +1,25 @@
 from typing import *
 import re
 import sys
-import time
 import traceback
 import threading
 
-from func_timeout import func_timeout, FunctionTimedOut
+from kivy.clock import Clock
 from kivy.logger import Logger
 from kivy.uix.button import Button
+from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.uix.screenmanager import Screen
-
-from aiventure.common.utils import StopThreadException
+from kivy.utils import escape_markup
+
+from aiventure.common.adventure import Adventure
+from aiventure.common.backend import CancelToken
+from aiventure.common.display import DisplayCache
+from aiventure.common.metrics import Spans
+from aiventure.common.summarizer import Summarizer
+from aiventure.common.utils import GenerationCancelledException
 from aiventure.client.utils import init_widget
 
-re_tag_start = r'\[[^/\[\]]+\]'
-re_tag_end = r'\[/[^\[\]]+\]'
-
 
 class MenuPopup(Popup):
     """
@@ -47,7 +50,7 @@ class MenuPopup(Popup):
         Triggered when the user quits the adventure using the quit button.
         """
         self.dismiss()
-        self.app.sm.current = 'menu'
+        self.app.show_screen('menu')
 
 
 class ErrorPopup(Popup):
@@ -59,6 +62,15 @@ class ErrorPopup(Popup):
         init_widget(self)
 
 
+class StoryEntryLabel(Label):
+    """
+    Shows a paragraph of the story in the output view. Pressing an entry in it selects the entry for editing.
+    """
+    def __init__(self, **kargs):
+        super(StoryEntryLabel, self).__init__(**kargs)
+        init_widget(self)
+
+
 class PlayScreen(Screen):
     """
     The in-game screen.
@@ -70,18 +82,38 @@ class PlayScreen(Screen):
         self.mode: str = ''
         self.edit_index: int = 0
         self.altergen: bool = False
+        self.cancel_token: Optional[CancelToken] = None
+        # Speculative generation of alternatives in the background
+        self.speculation_token: Optional[CancelToken] = None
+        self.speculation_unused: bool = False
+        self.speculation_stats: Dict[str, int] = {'started': 0, 'cancelled': 0, 'completed': 0, 'hits': 0}
+        # Summarization of the entries the AI no longer remembers, in the background
+        self.summary_token: Optional[CancelToken] = None
+        # Streaming output
+        self.streaming: bool = False
+        # The first paragraph which changed when the stream started, and the paragraphs from it on
+        self.stream_display: Tuple[int, List[str]] = (0, [])
+        self.stream_text: str = ''
+        self.stream_trigger = Clock.create_trigger(self._update_stream_output)
+        self.display_cache: Optional[DisplayCache] = None
 
     def on_enter(self) -> None:
         """
         Called upon entering this screen.
         """
-        self.ids.output_text.bind(on_ref_press=self.on_entry_selected)
         if len(self.app.adventure.actions) == 1 and len(self.app.adventure.results) == 0:
             prompt = self.app.adventure.actions.pop(0)
             self.on_send(prompt)
         else:
             self.on_update()
 
+    def on_leave(self) -> None:
+        """
+        Called upon leaving this screen.
+        """
+        self.stop_speculation()
+        self.stop_summarization()
+
     def on_update(self, scroll: bool = True, clear_input: bool = False) -> None:
         """
         Updates all core UI elements on this screen.
@@ -104,18 +136,11 @@ class PlayScreen(Screen):
         # optionally clear input text
         if clear_input:
             self.ids.input.text = ''
+        # update output text
+        self.show_paragraphs(*self.render_display())
         # optionally scroll to the bottom
         if scroll:
-            self.ids.scroll_input.scroll_y = 0
-        # update output text
-        self.ids.output_text.text = self.filter_display(self.app.adventure.full_story)
-        # temporarily disabling fancy text outputting because it's broken
-        """
-        if self.app.threads.get('output'):
-            self.app.threads['output'].stop(StopThreadException)
-        self.app.threads['output'] = StoppableThread(target=self._update_output_thread)
-        self.app.threads['output'].start()
-        """
+            self.scroll_to_bottom()
 
     def try_autosave(self) -> None:
         """
@@ -133,6 +158,9 @@ class PlayScreen(Screen):
         :param text: Override to use a different string instead of the input text.
         """
         text = text or self.ids.input.text
+        self.stop_speculation()
+        self.stop_summarization()
+        self.cancel_token = CancelToken(self.app.config.getfloat('ai', 'timeout'))
         self.app.threads['send'] = threading.Thread(target=self._on_send_thread, args=(text,))
         self.app.threads['send'].start()
 
@@ -142,47 +170,61 @@ class PlayScreen(Screen):
 
         :param text: The text in the input text box when send is pressed.
         """
-        text = self.filter_input(text)
+        spans = Spans()
+        with spans.span('filter'):
+            text = self.filter_input(text)
         self.ids.input.disabled = True
         self.ids.button_send.disabled = True
-        self.enable_bottom_buttons([])
-        error = self._try_send(text)
+        self.enable_bottom_buttons([self.ids.button_cancel])
+        error = self._try_send(text, spans)
         prev_mode = self.mode
         self.mode = ''
         self.altergen = False
-        self.on_update(scroll=(prev_mode == ''), clear_input=error is None)
+        try:
+            with spans.span('render'):
+                self.on_update(scroll=(prev_mode == ''), clear_input=error is None)
+            if error is None:
+                with spans.span('save'):
+                    self.try_autosave()
+        finally:
+            # also re-enabled if rendering or saving fails, so the game can go on
+            self.ids.input.disabled = False
+            self.ids.button_send.disabled = False
+        self.record_metrics(spans)
         if error is None:
-            self.try_autosave()
-        self.ids.input.disabled = False
-        self.ids.button_send.disabled = False
+            self.start_speculation()
+            self.start_summarization()
 
-    def _try_send(self, text: str) -> Optional[BaseException]:
+    def _try_send(self, text: str, spans: Optional[Spans] = None) -> Optional[BaseException]:
         """
         Determines and performs the send action depending on the current `mode`.
 
         :param text: The text to send.
+        :param spans: If given, the time spent generating is added to it.
+        :return: The error which stopped the send, or `None` if it succeeded.
         """
         result = None
         try:
             if self.altergen:
-                text += ' ' + self._generate(text, record=False, end=self.edit_index)
+                text += ' ' + self._generate(text, record=False, end=self.edit_index, spans=spans)
             if self.mode == '':
-                self._generate(text)
+                self._generate(text, spans=spans)
             elif self.mode == 'c':
-                self.app.adventure.context = text
+                self.app.adventure.edit('context', text)
             elif self.mode == 'a':
-                self.app.adventure.actions[self.edit_index] = text
+                self.app.adventure.edit('actions', text, self.edit_index)
             elif self.mode == 'r':
-                self.app.adventure.results[self.edit_index] = text
+                self.app.adventure.edit('results', text, self.edit_index)
             elif self.mode == 'm':
-                self.app.adventure.memory = text
-        except FunctionTimedOut as result:
-            popup = ErrorPopup()
-            popup.ids.error_text.text = 'The AI took too long to respond.\n' \
-                                        'Please try something else.'
-            popup.open()
-            Logger.info(f"AI: AI timed out.")
-        except Exception as result:
+                self.app.adventure.edit('memory', text)
+            if self.mode != '':
+                # the alternatives were generated for the story as it was before the edit
+                self.app.adventure.alternatives = []
+        except GenerationCancelledException as e:
+            result = e
+            Logger.info("AI: Generation cancelled.")
+        except Exception as e:
+            result = e
             popup = ErrorPopup()
             popup.ids.error_text.text = 'An unexpected error occurred.\n' \
                                         'Please try something else,\n' \
@@ -191,41 +233,253 @@ class PlayScreen(Screen):
             Logger.error(f"AI: {traceback.format_exc()}")
         return result
 
-    def _generate(self, text, record: bool = True, end: Optional[int] = None) -> Optional[str]:
+    def _generate(
+            self,
+            text,
+            record: bool = True,
+            end: Optional[int] = None,
+            spans: Optional[Spans] = None,
+    ) -> Optional[str]:
         """
         Tells the AI to generate new text.
 
         :param text: The input text for the AI to build upon.
         :param record: If True, the input text and the result will be added automatically to the adventure.
         :param end: The entry to start generating from.
-        :return: The result of the AI generation, or `None` if the AI timed out.
+        :param spans: If given, the time spent generating is added to it.
+        :return: The result of the AI generation, which is only partial if the AI timed out.
+        :raises GenerationCancelledException: If the generation was cancelled by the user.
         """
-        story_len = len(self.app.adventure.story)
+        if record:
+            self.start_stream(text)
+        try:
+            results = self._generate_candidates(
+                text,
+                self.app.config.getint('ai', 'candidates') if record else 1,
+                self.cancel_token,
+                callback=self.on_stream_chunk if record else None,
+                end=end,
+                spans=spans,
+            )
+        finally:
+            self.streaming = False
+        if self.cancel_token.cancelled:
+            raise GenerationCancelledException()
+        if self.cancel_token.timed_out:
+            Logger.info("AI: AI timed out, keeping the partial result.")
+        result = results.pop(0)
+        if record:
+            self.app.adventure.append(text, result)
+            self.app.adventure.alternatives = [r for r in results if r]
+            self.speculation_unused = False
+        return result
+
+    def _generate_candidates(
+            self,
+            text: str,
+            num_candidates: int,
+            cancel_token: CancelToken,
+            callback: Optional[Callable[[str], None]] = None,
+            end: Optional[int] = None,
+            spans: Optional[Spans] = None,
+    ) -> List[str]:
+        """
+        Tells the AI to generate one or more alternative texts, using the current AI settings.
+
+        :param text: The input text for the AI to build upon.
+        :param num_candidates: The number of alternative texts to generate.
+        :param cancel_token: The token used to stop the generation early.
+        :param callback: If given, called with each chunk of the first generated text as it is generated.
+        :param end: The entry to start generating from.
+        :param spans: If given, the time spent building the prompt ("tokenize"), generating and filtering the
+        results is added to it, along with the AI's own measurements.
+        :return: The filtered results of the AI generation.
+        """
+        spans = spans or Spans()
+        story_len = len(self.app.adventure.entries)
         end = story_len if end is None else end
         memory = self.app.config.getint('ai', 'memory')
         memory = story_len if memory <= 0 else min(memory, end)
-        story = self.app.adventure.get_ai_story(end-memory, end)
-        story = ' '.join(story) + (' ' + text if text else '')
-        timeout = self.app.config.getfloat('ai', 'timeout')
-        timeout = 604800.0 if timeout <= 0 else timeout
-        result = func_timeout(
-            timeout,
-            self.app.ai.generate,
-            args=(
+        max_length = self.app.config.getint('ai', 'max_length')
+        with spans.span('tokenize'):
+            encode = self.app.ai.encode
+            prompt = encode(' ' + text) if text else []
+            budget = self.app.ai.max_positions - max_length - len(prompt)
+            token_budget = self.app.config.getint('ai', 'token_budget')
+            budget = min(budget, token_budget - len(prompt)) if token_budget > 0 else budget
+            recall = self.app.config.getint('ai', 'recall')
+            # entries the AI no longer remembers, which the player's action may refer to
+            recalled = self.app.adventure.recall(text, recall, end-memory) if recall > 0 and text else []
+            story = self.app.adventure.get_ai_tokens(
+                encode, budget, end-memory, end, recalled, self.app.config.getint('ai', 'recall_tokens')
+            ) + prompt
+        with spans.span('generate'):
+            results = self.app.ai.generate_candidates(
                 story,
-                self.app.config.getint('ai', 'max_length'),
+                num_candidates,
+                max_length,
                 self.app.config.getint('ai', 'beam_searches'),
                 self.app.config.getfloat('ai', 'temperature'),
                 self.app.config.getint('ai', 'top_k'),
                 self.app.config.getfloat('ai', 'top_p'),
                 self.app.config.getfloat('ai', 'repetition_penalty'),
-            ),
+                callback=callback,
+                cancel_token=cancel_token,
+                stopping_criteria=self.app.stopping_criteria,
+                vocabulary=self.app.vocabulary,
+                spans=spans,
+            )
+        with spans.span('filter'):
+            return [self.filter_output(r) for r in results]
+
+    # SPECULATION
+
+    def start_speculation(self) -> None:
+        """
+        Starts generating alternatives to the last result in the background while the player reads, so that a retry
+        can use them instantly. Only if the speculate AI setting is set to `True`, and there are no alternatives
+        left already.
+        """
+        adventure = self.app.adventure
+        if not self.app.config.getboolean('ai', 'speculate') or adventure.alternatives or not adventure.results:
+            return
+        self.stop_speculation()
+        self.speculation_token = CancelToken()
+        self.speculation_stats['started'] += 1
+        self.app.threads['speculate'] = threading.Thread(
+            target=self._speculate_thread,
+            args=(self.speculation_token, adventure.actions[-1], adventure.results[-1]),
+            daemon=True,
         )
-        result = self.filter_output(result)
-        if record:
-            self.app.adventure.actions.append(text)
-            self.app.adventure.results.append(result)
-        return result
+        self.app.threads['speculate'].start()
+
+    def stop_speculation(self) -> None:
+        """
+        Cancels the background generation of alternatives, if it is running. The AI stops after its current
+        decoding step, so it never holds up a generation requested by the player for longer than that.
+        The speculation counts as cancelled only if it hadn't finished yet, which its own thread decides.
+        """
+        if self.speculation_token:
+            self.speculation_token.cancel()
+            self.speculation_token = None
+
+    def _speculate_thread(self, cancel_token: CancelToken, action: str, result: str) -> None:
+        """
+        Internal thread for generating alternatives to the last result in the background.
+
+        :param cancel_token: The token used to stop the speculation.
+        :param action: The last action, which the alternatives are generated for.
+        :param result: The last result, which the alternatives would replace.
+        """
+        adventure = self.app.adventure
+        end = len(adventure.entries) - 2
+        try:
+            results = self._generate_candidates(
+                action, max(1, self.app.config.getint('ai', 'candidates')), cancel_token, end=end
+            )
+        except Exception:
+            Logger.error(f"AI: {traceback.format_exc()}")
+            return
+        if cancel_token.cancelled:
+            self.speculation_stats['cancelled'] += 1
+            return
+        # the story may have moved on while the alternatives were being generated
+        if cancel_token.stopped or adventure is not self.app.adventure or adventure.alternatives \
+                or not adventure.results or adventure.actions[-1] is not action or adventure.results[-1] is not result:
+            return
+        adventure.alternatives = [r for r in results if r]
+        self.speculation_unused = True
+        self.speculation_stats['completed'] += 1
+        Logger.info(f"AI: Generated {len(adventure.alternatives)} alternatives in the background.")
+
+    # SUMMARIZATION
+
+    def start_summarization(self) -> None:
+        """
+        Starts summarizing the entries which have fallen out of the AI's memory in the background, if the summarize
+        AI setting is set to `True` and enough of them have piled up since they were last summarized.
+        """
+        memory = self.app.config.getint('ai', 'memory')
+        if not self.app.config.getboolean('ai', 'summarize') or memory <= 0:
+            return
+        adventure = self.app.adventure
+        summarizer = Summarizer(self.app.config.getint('ai', 'summary_length'))
+        pending = summarizer.get_pending(adventure, len(adventure.entries) - memory)
+        if pending is None:
+            return
+        self.stop_summarization()
+        self.summary_token = CancelToken()
+        self.app.threads['summarize'] = threading.Thread(
+            target=self._summarize_thread,
+            args=(self.summary_token, summarizer, *pending),
+            daemon=True,
+        )
+        self.app.threads['summarize'].start()
+
+    def stop_summarization(self) -> None:
+        """
+        Cancels the background summarization, if it is running. The summary is left as it was.
+        """
+        if self.summary_token:
+            self.summary_token.cancel()
+            self.summary_token = None
+
+    def _summarize_thread(self, cancel_token: CancelToken, summarizer: Summarizer, start: int, end: int) -> None:
+        """
+        Internal thread for summarizing entries in the background.
+
+        :param cancel_token: The token used to stop the summarization.
+        :param summarizer: The summarizer to use.
+        :param start: The first entry which isn't in the summary yet.
+        :param end: The entry to summarize the story up to.
+        """
+        adventure = self.app.adventure
+        versions = adventure.versions[start:end]
+        try:
+            summary = summarizer.summarize(
+                self.app.ai, adventure, start, end, cancel_token, self.app.stopping_criteria
+            )
+        except Exception:
+            Logger.error(f"AI: {traceback.format_exc()}")
+            return
+        # the adventure is only changed on the main thread, where it is saved
+        Clock.schedule_once(lambda dt: self.apply_summary(cancel_token, adventure, versions, summary, start, end))
+
+    def apply_summary(
+            self,
+            cancel_token: CancelToken,
+            adventure: Adventure,
+            versions: List[int],
+            summary: str,
+            start: int,
+            end: int,
+    ) -> None:
+        """
+        Replaces the summary of an adventure with one generated in the background, unless the summarized entries
+        have changed since.
+
+        :param cancel_token: The token used to stop the summarization.
+        :param adventure: The adventure which was summarized.
+        :param versions: The versions of the summarized entries when the summary was started.
+        :param summary: The unaltered text generated for the new summary.
+        :param start: The first entry which wasn't in the summary yet.
+        :param end: The entry the story was summarized up to.
+        """
+        # the summarized entries may have been edited or reverted in the meantime
+        if cancel_token.stopped or adventure is not self.app.adventure or adventure.summary_end != start \
+                or adventure.versions[start:end] != versions:
+            return
+        # a summary which came out empty still moves on, rather than being retried after every turn
+        adventure.summarize(self.filter_output(summary) or adventure.summary, end)
+        Logger.info(f"AI: Summarized the story up to entry {end}.")
+
+    @property
+    def speculation_hit_rate(self) -> float:
+        """
+        :return: The fraction of completed background generations whose alternatives were used by a retry.
+        """
+        completed = self.speculation_stats['completed']
+        return self.speculation_stats['hits'] / completed if completed else 0.0
 
     def on_entry_selected(self, _, ref) -> None:
         """
@@ -266,18 +520,30 @@ class PlayScreen(Screen):
         """
         Triggered when button_revert is pressed.
         """
-        self.app.adventure.actions = self.app.adventure.actions[:-1]
-        self.app.adventure.results = self.app.adventure.results[:-1]
+        self.app.adventure.revert()
+        self.app.adventure.alternatives = []
+        self.stop_speculation()
         self.on_update()
         self.try_autosave()
 
     def on_retry(self) -> None:
         """
         Triggered when button_retry is pressed.
-        """
+        Uses the next unused alternative to the last result if there is one, otherwise generates new ones.
+        """
+        if self.app.adventure.alternatives:
+            self.stop_speculation()
+            self.app.adventure.edit('results', self.app.adventure.alternatives.pop(0), -1)
+            if self.speculation_unused:
+                self.speculation_unused = False
+                self.speculation_stats['hits'] += 1
+                Logger.info(f"AI: Speculation hit rate {self.speculation_hit_rate:.0%}.")
+            self.on_update()
+            self.try_autosave()
+            self.start_speculation()
+            return
         action = self.app.adventure.actions[-1]
-        self.app.adventure.actions = self.app.adventure.actions[:-1]
-        self.app.adventure.results = self.app.adventure.results[:-1]
+        self.app.adventure.revert()
         self.on_send(action)
 
     def on_memory(self) -> None:
@@ -298,46 +564,75 @@ class PlayScreen(Screen):
     def on_cancel(self) -> None:
         """
         Triggered when button_cancel is pressed.
+        Stops the AI generation in progress, if there is one, otherwise leaves the current editing mode.
         """
+        if self.app.threads.get('send') and self.app.threads['send'].is_alive():
+            self.cancel_token.cancel()
+            return
         self.mode = ''
         self.on_update(scroll=False, clear_input=True)
         pass
 
     # OUTPUT AND DISPLAY
 
-    def _update_output_thread(self) -> None:
+    def start_stream(self, text: str) -> None:
         """
-        Updates the output text with a cool scrolling text effect.
+        Prepares the output text for showing a result as it is being generated.
+
+        :param text: The action the result is being generated for.
         """
-        prev_text = self.ids.output_text.text
-        next_text = self.filter_display(self.app.adventure.full_story)
-        text_diff = len(next_text) - len(prev_text)
-        try:
-            if 0 < text_diff <= 800:
-                end_tags = []
-                i = len(prev_text)
-                print(next_text)
-                while i in range(len(prev_text), len(next_text)):
-                    raw_show = next_text[:i + 1]
-                    raw_hide = next_text[i + 1:]
-                    start_match = re.match(re_tag_start, raw_hide)
-                    end_match = re.match(re_tag_end, raw_hide)
-                    result = raw_show
-                    for e in reversed(end_tags):
-                        result += e
-                    if start_match:
-                        i += len(start_match.group(0))
-                        end_tag = re.findall(re_tag_end, raw_hide)[-len(end_tags) - 1]
-                        end_tags.append(end_tag)
-                    elif end_match:
-                        i += len(end_match.group(0))
-                        end_tags.pop(-1)
-                    self.ids.output_text.text = result
-                    i += 1
-                    time.sleep(0.025)
-        except StopThreadException:
-            pass
-        self.ids.output_text.text = self.filter_display(self.app.adventure.full_story)
+        self.stream_display = self.render_display(text)
+        self.stream_text = ''
+        self.streaming = True
+        self.stream_trigger()
+
+    def on_stream_chunk(self, chunk: str) -> None:
+        """
+        Called from the generating thread with each new chunk of generated text.
+        The output text is updated on the next frame, so several chunks arriving at once only update it once.
+
+        :param chunk: The newly generated text.
+        """
+        self.stream_text += chunk
+        self.stream_trigger()
+
+    def _update_stream_output(self, *_) -> None:
+        """
+        Shows the raw, unfiltered result generated so far after the rest of the story.
+        """
+        if not self.streaming:
+            return
+        start, paragraphs = self.stream_display
+        paragraphs = paragraphs or ['']
+        self.show_paragraphs(start, paragraphs[:-1] + [paragraphs[-1] + ' ' + escape_markup(self.stream_text)])
+        self.scroll_to_bottom()
+
+    def show_paragraphs(self, start: int, paragraphs: List[str]) -> None:
+        """
+        Shows the given paragraphs in the output view in place of the ones from a paragraph on, only updating the
+        ones which changed, so that the view doesn't have to lay out the whole story again.
+
+        :param start: The index of the first paragraph to replace. The ones before it are kept as they are.
+        :param paragraphs: The display string of each paragraph from the first one to replace on.
+        """
+        data = self.ids.output_view.data
+        start = min(start, len(data))
+        end = start + len(paragraphs)
+        for i in range(start, min(len(data), end)):
+            if data[i]['text'] != paragraphs[i - start]:
+                data[i] = {'text': paragraphs[i - start]}
+        if len(data) > end:
+            del data[end:]
+        elif end > len(data):
+            data.extend({'text': p} for p in paragraphs[len(data) - start:])
+
+    def scroll_to_bottom(self) -> None:
+        """
+        Scrolls the output view to the end, once again after the paragraphs shown last have been laid out and
+        their heights are known.
+        """
+        self.ids.output_view.scroll_y = 0
+        Clock.schedule_once(lambda dt: setattr(self.ids.output_view, 'scroll_y', 0))
 
     # FILTERING
 
@@ -348,10 +643,7 @@ class PlayScreen(Screen):
         :param text: The input text.
         :return: The filtered input text.
         """
-        result = text
-        for f in self.app.input_filters:
-            result = f(result)
-        return result
+        return self.app.input_filters(text)
 
     def filter_output(self, text: str) -> str:
         """
@@ -360,10 +652,7 @@ class PlayScreen(Screen):
         :param text: The output text.
         :return: The filtered output text.
         """
-        result = text
-        for f in self.app.output_filters:
-            result = f(result)
-        return result
+        return self.app.output_filters(text)
 
     def filter_display(self, story: List[str]) -> str:
         """
@@ -373,3 +662,55 @@ class PlayScreen(Screen):
         :return: The filtered story text.
         """
         return self.app.display_filter(story)
+
+    def render_display(self, extra: Optional[str] = None) -> Tuple[int, List[str]]:
+        """
+        Renders the current adventure's story for display, only rendering the entries which changed since the last
+        time if the display filter supports it.
+
+        :param extra: If given, an entry to show after the story, which isn't part of it yet.
+        :return: The index of the first paragraph which changed since the story was last rendered, and the filtered
+        story text from it on, split into paragraphs.
+        """
+        story = self.app.adventure.full_story
+        filter_entry = self.app.display_entry_filter
+        if filter_entry is None:
+            # the whole story is shown again, so a cache wouldn't know which paragraphs are shown anymore
+            self.display_cache = None
+            return 0, self.filter_display(story if extra is None else story + [extra]).split('\n\n')
+        if self.display_cache is None or self.display_cache.filter_entry is not filter_entry:
+            # the display filter's module was reloaded, so every entry is rendered again
+            self.display_cache = DisplayCache(filter_entry)
+        return self.display_cache.render_paragraphs(story, extra)
+
+    # METRICS
+
+    def record_metrics(self, spans: Spans) -> None:
+        """
+        Records the timings of a turn to the metrics log, if it is enabled, and shows them in the debug overlay,
+        if the debug overlay setting is set to `True`.
+
+        :param spans: The timings of the turn.
+        """
+        values = spans.finish()
+        if self.app.metrics is not None:
+            try:
+                self.app.metrics.record(values)
+            except OSError as e:
+                Logger.warning(f'Metrics: Could not write the metrics of the turn: {e}')
+        overlay = self.ids.debug_overlay
+        if not self.app.config.getboolean('general', 'debug_overlay'):
+            overlay.text = ''
+            overlay.height = 0
+            return
+        overlay.text = ' | '.join([
+            f'in {values.get("tokens_in", 0):.0f} tok ({values.get("tokens_cached", 0):.0f} cached)',
+            f'out {values.get("tokens_out", 0):.0f} tok',
+            f'prefill {values.get("prefill_ms", 0):.0f} ms',
+            f'decode {values.get("decode_tokens_per_sec", 0):.1f} tok/s',
+            f'filter {values.get("filter_ms", 0):.1f} ms',
+            f'render {values.get("render_ms", 0):.1f} ms',
+            f'save {values.get("save_ms", 0):.1f} ms',
+            f'total {values["total_ms"]:.0f} ms',
+        ])
+        overlay.height = 24
@@ -1,7 +1,166 @@
 from typing import *
+import itertools
+import threading
+
+from aiventure.common.retrieval import PassageIndex
+
+# Every change to a story entry gives it a new version, unique across all adventures
+version_counter: Iterator[int] = itertools.count(1)
+
+
+class EntryView(Sequence[str]):
+    """
+    A view of every other entry of a story, either its actions or its results, without copying them.
+    """
+    __slots__ = ('entries', 'versions', 'offset', 'edits')
+
+    def __init__(self, entries: List[str], versions: List[int], offset: int, edits: Optional[List[int]] = None):
+        """
+        :param entries: The interleaved actions and results of the story.
+        :param versions: The version of each entry.
+        :param offset: 0 to view the actions, 1 to view the results.
+        :param edits: If given, the position of every entry replaced through the view is added to it.
+        """
+        self.entries: List[str] = entries
+        self.versions: List[int] = versions
+        self.offset: int = offset
+        self.edits: Optional[List[int]] = edits
+
+    def __len__(self) -> int:
+        return (len(self.entries) + 1 - self.offset) // 2
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self.entries[i * 2 + self.offset] for i in range(*index.indices(len(self)))]
+        return self.entries[self._position(index)]
+
+    def __setitem__(self, index: int, text: str) -> None:
+        position = self._position(index)
+        self.entries[position] = text
+        self.versions[position] = next(version_counter)
+        if self.edits is not None:
+            self.edits.append(position)
+
+    def __eq__(self, other: Any) -> bool:
+        return list(self) == list(other) if isinstance(other, (EntryView, list)) else NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def append(self, text: str) -> None:
+        """
+        Adds an entry to the end of the story, which must be the next entry of this view.
+
+        :param text: The text of the entry.
+        """
+        if len(self.entries) % 2 != self.offset:
+            raise ValueError('Actions and results must alternate')
+        self.entries.append(text)
+        self.versions.append(next(version_counter))
+
+    def pop(self, index: int = -1) -> str:
+        """
+        Removes an entry from the story, which must be the last entry of the story.
+
+        :param index: The index of the entry in this view.
+        :return: The removed entry.
+        """
+        position = self._position(index)
+        if position != len(self.entries) - 1:
+            raise IndexError('Only the last entry of the story can be removed')
+        self.versions.pop()
+        return self.entries.pop()
+
+    def _position(self, index: int) -> int:
+        """
+        :param index: The index of an entry in this view, which may be negative.
+        :return: The position of the entry in the story.
+        """
+        length = len(self)
+        if not -length <= index < length:
+            raise IndexError('Story entry index out of range')
+        return (index % length) * 2 + self.offset
+
+
+class StoryView(Sequence[str]):
+    """
+    A read-only view of a story's entries, optionally preceded by its context, without copying them.
+    """
+    __slots__ = ('head', 'entries', 'head_versions', 'entry_versions', 'edits')
+
+    def __init__(
+            self,
+            head: List[str],
+            entries: List[str],
+            head_versions: List[int],
+            entry_versions: List[int],
+            edits: Optional[List[int]] = None,
+    ):
+        """
+        :param head: The entries before the story, ie. the context if there is one.
+        :param entries: The interleaved actions and results of the story.
+        :param head_versions: The version of each entry before the story.
+        :param entry_versions: The version of each entry of the story.
+        :param edits: If given, the position in `entries` of every entry which was replaced in place, in order.
+        Entries are otherwise only ever added and removed at the end.
+        """
+        self.head: List[str] = head
+        self.entries: List[str] = entries
+        self.head_versions: List[int] = head_versions
+        self.entry_versions: List[int] = entry_versions
+        self.edits: Optional[List[int]] = edits
+
+    @property
+    def versions(self) -> List[int]:
+        """
+        :return: The version of each entry, which changes whenever the entry does.
+        """
+        return self.head_versions + self.entry_versions
+
+    def __len__(self) -> int:
+        return len(self.head) + len(self.entries)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if 0 <= index < len(self.head):
+            return self.head[index]
+        if index < 0:
+            raise IndexError('Story entry index out of range')
+        return self.entries[index - len(self.head)]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.head
+        yield from self.entries
+
+    def get_version(self, index: int) -> int:
+        """
+        :param index: The index of an entry in the view, which can't be negative.
+        :return: The version of the entry.
+        """
+        if index < len(self.head):
+            return self.head_versions[index]
+        return self.entry_versions[index - len(self.head)]
+
+    def __add__(self, other: List[str]) -> List[str]:
+        return self.head + self.entries + list(other)
+
+    def __eq__(self, other: Any) -> bool:
+        return list(self) == list(other) if isinstance(other, (StoryView, list)) else NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
 
 
 class Adventure(object):
+    __slots__ = (
+        'name', '_context', 'context_version', 'memory', 'summary', 'summary_end', 'entries', 'versions',
+        'edits', 'alternatives', 'token_cache', 'token_encoder', 'changes', 'index', 'index_path',
+        'index_lock',
+    )
+
     def __init__(
             self,
             name: str = None,
@@ -10,43 +169,212 @@ class Adventure(object):
         self.name: str = name
         self.context: str = context
         self.memory: str = ''
-        self.actions: List[str] = []
-        self.results: List[str] = []
+        # A summary of the entries before `summary_end`, which replaces them in the AI's prompt
+        self.summary: str = ''
+        self.summary_end: int = 0
+        # The actions and results, interspersed, starting with the first action
+        self.entries: List[str] = []
+        # The version of each entry
+        self.versions: List[int] = []
+        # The position of every entry which was edited in place, so the entries which changed can be found without
+        # comparing every version. Cleared by whatever renders the changes, or started over if nothing does
+        self.edits: List[int] = []
+        # Unused alternatives to the last result, which a retry can use instead of generating a new one
+        self.alternatives: List[str] = []
+        # Token ids of previously encoded entries, keyed by their text, so that edited entries are re-encoded
+        self.token_cache: Dict[Tuple[str, bool], List[int]] = {}
+        self.token_encoder: Optional[Callable[[str], List[int]]] = None
+        # The changes made since the adventure was last saved, or `None` if it has to be saved in full
+        self.changes: Optional[List[Dict[str, Any]]] = None
+        # The entries indexed for recalling the relevant ones
+        self.index: PassageIndex = PassageIndex()
+        # The file the index was saved to alongside the adventure, loaded the first time the index is needed
+        self.index_path: Optional[str] = None
+        # Held while the entries or the index change, or the index is read, since background generations recall
+        # entries while the player keeps changing them
+        self.index_lock: threading.RLock = threading.RLock()
+
+    @property
+    def context(self) -> str:
+        return self._context
+
+    @context.setter
+    def context(self, context: str) -> None:
+        self._context = context
+        self.context_version = next(version_counter)
+
+    @property
+    def actions(self) -> EntryView:
+        """
+        :return: A view of the user actions.
+        """
+        return EntryView(self.entries, self.versions, 0, self.edits)
+
+    @property
+    def results(self) -> EntryView:
+        """
+        :return: A view of the AI results.
+        """
+        return EntryView(self.entries, self.versions, 1, self.edits)
 
     def to_dict(self) -> dict:
         return {
             'name': self.name,
             'context': self.context,
             'memory': self.memory,
-            'actions': self.actions,
-            'results': self.results
+            'summary': self.summary,
+            'summary_end': self.summary_end,
+            'actions': self.entries[0::2],
+            'results': self.entries[1::2]
         }
 
     def from_dict(self, d: Dict[str, Any]):
         self.name = d['name']
         self.context = d['context']
         self.memory = d['memory']
-        self.actions = d['actions']
-        self.results = d['results']
+        self.summary = d.get('summary', '')
+        self.summary_end = d.get('summary_end', 0)
+        actions, results = d['actions'], d['results']
+        self.entries = [s for p in zip(actions, results) for s in p]
+        if len(actions) > len(results):
+            self.entries.append(actions[len(results)])
+        self.versions = [next(version_counter) for _ in self.entries]
+        self.edits = []
+        self.alternatives = []
+        self.token_cache = {}
+        self.changes = None
+        self.index = PassageIndex()
+        self.index_path = None
+
+    def append(self, action: str, result: str) -> None:
+        """
+        Adds an action and its result to the end of the story.
+
+        :param action: The user action.
+        :param result: The AI result.
+        """
+        self.apply_change({'op': 'append', 'action': action, 'result': result})
+
+    def edit(self, field: str, text: str, index: Optional[int] = None) -> None:
+        """
+        Replaces the context, the memory, or a single action or result.
+
+        :param field: One of 'context', 'memory', 'actions' or 'results'.
+        :param text: The new text.
+        :param index: The index of the action or result to replace, which may be negative.
+        """
+        change = {'op': 'edit', 'field': field, 'text': text}
+        if index is not None:
+            change['index'] = index % len(getattr(self, field))
+        self.apply_change(change)
+
+    def revert(self) -> None:
+        """
+        Removes the last action and its result from the story.
+        """
+        self.apply_change({'op': 'revert'})
+
+    def summarize(self, summary: str, end: int) -> None:
+        """
+        Replaces the summary of the story's oldest entries.
+
+        :param summary: The new summary.
+        :param end: The number of entries the summary covers, from the start of the story.
+        """
+        self.apply_change({'op': 'summarize', 'summary': summary, 'end': end})
+
+    def apply_change(self, change: Dict[str, Any]) -> None:
+        """
+        Applies a single change to the adventure, and records it so it can be saved incrementally.
+        Replaying the recorded changes on the adventure as it was when it was last saved recreates it.
+
+        :param change: The change, as created by `append`, `edit`, `revert` or `summarize`.
+        """
+        with self.index_lock:
+            op = change['op']
+            # the index is only kept up to date while it matches the entries, and is synced by `get_index` otherwise
+            indexed = len(self.index) == len(self.entries)
+            if op == 'append':
+                self.entries += (change['action'], change['result'])
+                self.versions += (next(version_counter), next(version_counter))
+                if indexed:
+                    self.index.add(change['action'])
+                    self.index.add(change['result'])
+            elif op == 'edit' and 'index' in change:
+                view = getattr(self, change['field'])
+                position = change['index'] * 2 + view.offset
+                old_text = self.entries[position]
+                view[change['index']] = change['text']
+                if indexed:
+                    self.index.replace(position, old_text, change['text'])
+                if len(self.edits) > len(self.entries):
+                    # a new list tells the views rendered from the old one to compare every entry instead
+                    self.edits = []
+            elif op == 'edit':
+                setattr(self, change['field'], change['text'])
+            elif op == 'revert':
+                # also removes an action without a result
+                end = max(0, len(self.actions) - 1) * 2
+                if indexed:
+                    for text in reversed(self.entries[end:]):
+                        self.index.remove(text)
+                del self.entries[end:]
+                del self.versions[end:]
+                # the summary can't be taken apart, so it is kept, but the removed entries aren't skipped anymore
+                self.summary_end = min(self.summary_end, end)
+            elif op == 'summarize':
+                self.summary = change['summary']
+                self.summary_end = change['end']
+            else:
+                raise ValueError(f'Unknown change "{op}"')
+            if self.changes is not None:
+                self.changes.append(change)
+
+    def get_index(self) -> PassageIndex:
+        """
+        :return: The index of the story's entries, loaded from `index_path` if it hasn't been yet, and brought up to
+        date first if entries were changed without going through `apply_change`.
+        """
+        with self.index_lock:
+            if len(self.index) != len(self.entries):
+                if self.index_path is not None:
+                    self.index.load(self.index_path)
+                    self.index_path = None
+                self.index.sync(self.entries)
+            return self.index
+
+    def recall(self, query: str, k: int, end: int) -> List[int]:
+        """
+        Finds the entries most relevant to a query among the ones the AI no longer remembers.
+
+        :param query: The text to find relevant entries for, such as the player's action.
+        :param k: The maximum number of entries to return.
+        :param end: The first entry the AI still remembers. Only entries before it are searched.
+        :return: The indices of the most relevant entries, most relevant first.
+        """
+        with self.index_lock:
+            return [i for i, _ in self.get_index().search(query, k, end)]
 
     @property
-    def story(self) -> list:
+    def story(self) -> StoryView:
         """
         The user actions and AI results in chronological order, not including the story context.
 
-        :return: A list of action and result strings, interspersed, starting with the first action.
+        :return: A view of the action and result strings, interspersed, starting with the first action.
         """
-        return [s for p in zip(self.actions, self.results) for s in p]
+        return StoryView([], self.entries, [], self.versions, self.edits)
 
     @property
-    def full_story(self) -> list:
+    def full_story(self) -> StoryView:
         """
         The user actions and AI results in chronological order, including the story context.
 
-        :return: The story context string, followed by a list of action and result strings, interspersed, starting
-        with the first action.
+        :return: A view of the story context string, followed by the action and result strings, interspersed,
+        starting with the first action.
         """
-        return ([self.context] if self.context else []) + self.story
+        if self.context:
+            return StoryView([self.context], self.entries, [self.context_version], self.versions, self.edits)
+        return StoryView([], self.entries, [], self.versions, self.edits)
 
     def get_ai_story(self, start: Optional[int] = None, end: Optional[int] = None) -> list:
         """
@@ -55,11 +383,87 @@ class Adventure(object):
         :param start: Where to start remembering the story from.
         :param end: Where the "end" of the story is.
         :return: The story context string, followed by a list of the last `self.memory` action and result strings,
-        interspersed.
+        interspersed. If the story has a summary, it follows the memory and replaces the entries it covers.
         """
         start = 0 if start is None else start
-        end = len(self.story) if end is None else end
+        end = len(self.entries) if end is None else end
         result = [self.context] if self.context else []
         result += [self.memory]
-        result += self.story[start:end]
+        if self.summary:
+            result += [self.summary]
+            start = max(start, self.summary_end)
+        result += self.entries[start:end]
         return result
+
+    def get_tokens(self, text: str, encode: Callable[[str], List[int]], lead: bool = True) -> List[int]:
+        """
+        Retrieves the token ids of a story entry, encoding it only if it hasn't been encoded before.
+
+        :param text: The text of the story entry.
+        :param encode: The function used to encode text into token ids.
+        :param lead: If `True`, the entry is encoded with a leading space, separating it from the previous entry.
+        :return: The token ids of the entry.
+        """
+        if encode != self.token_encoder:
+            self.token_cache = {}
+            self.token_encoder = encode
+        key = (text, lead)
+        tokens = self.token_cache.get(key)
+        if tokens is None:
+            tokens = encode(' ' + text if lead else text)
+            self.token_cache[key] = tokens
+        return tokens
+
+    def get_ai_tokens(
+            self,
+            encode: Callable[[str], List[int]],
+            budget: int,
+            start: Optional[int] = None,
+            end: Optional[int] = None,
+            recalled: Optional[List[int]] = None,
+            recall_budget: int = 0,
+    ) -> List[int]:
+        """
+        Retrieves the token ids of a clipped portion of the adventure, including the story's memory, for purposes of
+        AI generation. The context, memory and summary are always included, followed by the recalled entries which
+        fit in their own budget, and then as many of the newest entries not covered by the summary as fit in the
+        token budget.
+
+        :param encode: The function used to encode text into token ids.
+        :param budget: The maximum number of tokens to return.
+        :param start: Where to start remembering the story from.
+        :param end: Where the "end" of the story is.
+        :param recalled: The indices of older entries to include, most relevant first, as returned by `recall`.
+        :param recall_budget: The maximum number of tokens of the recalled entries, which counts towards the budget.
+        :return: The token ids of the story context, memory, summary, recalled entries, and the last entries that
+        fit within the budget.
+        """
+        start = 0 if start is None else max(start, 0)
+        end = len(self.entries) if end is None else end
+        if self.summary:
+            start = max(start, self.summary_end)
+        head = []
+        for text in (self.context, self.memory, self.summary):
+            if text:
+                head += self.get_tokens(text, encode, lead=len(head) > 0)
+        passages = {}
+        remaining = recall_budget
+        for i in recalled or []:
+            tokens = self.get_tokens(self.entries[i], encode)
+            if len(tokens) <= remaining:
+                passages[i] = tokens
+                remaining -= len(tokens)
+        # in the order they happened, so they read as part of the story
+        for i in sorted(passages):
+            head += passages[i]
+        entries = []
+        remaining = budget - len(head)
+        for i in range(end - 1, start - 1, -1):
+            text = self.entries[i]
+            tokens = self.get_tokens(text, encode, lead=i > start or len(head) > 0)
+            if len(tokens) > remaining:
+                break
+            entries.append(tokens)
+            remaining -= len(tokens)
+        result = head + [t for tokens in reversed(entries) for t in tokens]
+        return result[-budget:] if budget > 0 else []
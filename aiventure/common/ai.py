@@ -1,14 +1,250 @@
 from typing import *
-import re
+import copy
+import os
+import pickle
+import threading
+import time
 
 import torch
 import random
 import numpy
 
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from transformers import (
+    GPT2LMHeadModel,
+    GPT2Tokenizer,
+    LogitsProcessor,
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+from transformers.pytorch_utils import Conv1D
 
+from aiventure.common.backend import Backend, CancelToken
+from aiventure.common.metrics import Spans
+from aiventure.common.stopping import StoppingCriterion
+from aiventure.common.utils import get_model_fingerprint
+from aiventure.common.vocabulary import Vocabulary
 
-class AI(object):
+# The precisions a model can be loaded in, and the data type of its weights in each
+precisions: Dict[str, torch.dtype] = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'int8': torch.qint8,
+}
+
+
+def get_past_length(past: Any) -> int:
+    """
+    :param past: The cached key/value states of a model, either as a `Cache` object or as legacy tuples.
+    :return: The number of token positions held in the cache.
+    """
+    if past is None:
+        return 0
+    if hasattr(past, 'get_seq_length'):
+        return past.get_seq_length()
+    return past[0][0].shape[-2]
+
+
+def crop_past(past: Any, length: int) -> Any:
+    """
+    Crops cached key/value states down to the first `length` token positions.
+
+    :param past: The cached key/value states of a model, either as a `Cache` object or as legacy tuples.
+    :param length: The number of token positions to keep.
+    :return: The cropped key/value states.
+    """
+    if past is None or get_past_length(past) == length:
+        return past
+    if hasattr(past, 'crop'):
+        past.crop(length)
+        return past
+    return tuple(tuple(t[..., :length, :] for t in layer) for layer in past)
+
+
+def expand_past(past: Any, batch_size: int) -> Any:
+    """
+    Repeats cached key/value states of a single sequence for a batch of sequences, leaving the given states as
+    they are.
+
+    :param past: The cached key/value states of a model, either as a `Cache` object or as legacy tuples.
+    :param batch_size: The number of sequences in the batch.
+    :return: The expanded key/value states.
+    """
+    if batch_size == 1:
+        return past
+    if hasattr(past, 'batch_repeat_interleave'):
+        past = copy.deepcopy(past)
+        past.batch_repeat_interleave(batch_size)
+        return past
+    return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in past)
+
+
+def select_past(past: Any, indices: torch.Tensor) -> Any:
+    """
+    Selects the cached key/value states of some of the sequences in a batch, in place for `Cache` objects.
+
+    :param past: The cached key/value states of a model, either as a `Cache` object or as legacy tuples.
+    :param indices: The indices of the sequences to keep.
+    :return: The selected key/value states.
+    """
+    if hasattr(past, 'batch_select_indices'):
+        past.batch_select_indices(indices)
+        return past
+    return tuple(tuple(t.index_select(0, indices) for t in layer) for layer in past)
+
+
+def iter_tensors(tensors: Any) -> Iterator[torch.Tensor]:
+    """
+    :param tensors: A tensor, a `Cache` object, or any nesting of tuples, lists and dictionaries of tensors.
+    :return: An iterator over all of the tensors.
+    """
+    if isinstance(tensors, torch.Tensor):
+        yield tensors
+        return
+    if isinstance(tensors, dict):
+        tensors = tensors.values()
+    elif hasattr(tensors, 'to_legacy_cache'):
+        tensors = tensors.to_legacy_cache()
+    if isinstance(tensors, (tuple, list, type({}.values()))):
+        for t in tensors:
+            yield from iter_tensors(t)
+
+
+def get_tensors_size(tensors: Any) -> int:
+    """
+    :param tensors: A tensor, a `Cache` object, or any nesting of tuples, lists and dictionaries of tensors.
+    :return: The total size of the tensors in bytes. Tensors sharing memory, like tied weights, are counted once.
+    """
+    sizes = {t.data_ptr(): t.element_size() * t.nelement() for t in iter_tensors(tensors)}
+    return sum(sizes.values())
+
+
+def get_auto_precision(use_gpu: bool) -> str:
+    """
+    :param use_gpu: Whether the model will be running on the gpu.
+    :return: The fastest precision which doesn't noticeably affect the output on the given device.
+    Half precision matrix multiplication is slow or unsupported on most cpus, so cpus use full precision.
+    """
+    return 'float16' if use_gpu else 'float32'
+
+
+def quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Dynamically quantizes the weights of all linear layers of a model to int8. Activations stay in full precision.
+    gpt-2 implements its linear layers as transposed `Conv1D` layers, which are converted to `Linear` layers first.
+
+    :param model: The model to quantize.
+    :return: The quantized model.
+    """
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, Conv1D):
+                linear = torch.nn.Linear(child.weight.shape[0], child.nf)
+                linear.weight = torch.nn.Parameter(child.weight.t().contiguous())
+                linear.bias = child.bias
+                setattr(module, name, linear)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def compare_precisions(
+        model_path: str,
+        text: str,
+        num_tokens: int = 60,
+        use_gpu: bool = False,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Loads a model in every precision it supports, and measures how they compare in speed and output quality.
+
+    :param model_path: The path of the model to compare.
+    :param text: The text to measure the perplexity of, which is also used as the input for measuring speed.
+    :param num_tokens: The number of tokens to generate when measuring speed.
+    :param use_gpu: Whether to run the models on the gpu, if there is one. int8 precision always runs on the cpu.
+    :return: For each precision, the time taken to prefill the text in milliseconds (`prefill_ms`), the number of
+    tokens generated per second (`tokens_per_sec`), the perplexity of the text (`perplexity`) and the fraction of
+    next token predictions agreeing with full precision (`agreement`).
+    """
+    results = {}
+    reference = None
+    for precision in precisions:
+        try:
+            ai = AI(model_path, use_gpu=use_gpu, precision=precision)
+            result = ai.evaluate(text, num_tokens)
+        except (RuntimeError, NotImplementedError):
+            # not every precision is supported on every device
+            continue
+        predictions = result.pop('predictions')
+        reference = reference or predictions
+        result['agreement'] = sum(a == b for a, b in zip(predictions, reference)) / max(1, len(reference))
+        results[precision] = result
+    return results
+
+
+class CancelCriteria(StoppingCriteria):
+    """
+    A stopping criterion which stops generation once the given cancel token is cancelled or its deadline passes.
+    """
+    def __init__(self, cancel_token: CancelToken):
+        self.cancel_token: CancelToken = cancel_token
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        stop = self.cancel_token.check()
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+class TokenStoppingCriteria(StoppingCriteria):
+    """
+    Checks `StoppingCriterion`s, which only look at the tokens generated for a single sequence, for every sequence
+    of a generation. A sequence stops as soon as any of the criteria says so.
+    """
+    def __init__(self, criteria: List[StoppingCriterion], input_len: int, decode: Callable[[List[int]], str]):
+        """
+        :param criteria: The criteria to check.
+        :param input_len: The number of input tokens before the generated ones.
+        :param decode: Decodes token ids into text.
+        """
+        self.criteria: List[StoppingCriterion] = criteria
+        self.input_len: int = input_len
+        self.decode: Callable[[List[int]], str] = decode
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        stop = [any(c(output_ids, self.decode) for c in self.criteria)
+                for output_ids in input_ids[:, self.input_len:].tolist()]
+        return torch.tensor(stop, dtype=torch.bool, device=input_ids.device)
+
+
+class VocabularyLogitsProcessor(LogitsProcessor):
+    """
+    Applies a vocabulary's biases and bans, compiled for one tokenizer. The biases, and the bans of single tokens,
+    are a dense tensor added to the logits. Phrases of several tokens are banned through a trie of their token
+    prefixes, flattened into a table from each prefix to the tokens which would complete a banned phrase, so a step
+    only looks up the sequence's last few tokens once per prefix length, however many words there are.
+    """
+    def __init__(self, bias: torch.Tensor, prefixes: Dict[Tuple[int, ...], List[int]]):
+        """
+        :param bias: The bias of every token, with banned tokens at minus infinity.
+        :param prefixes: The tokens banned after each prefix of a banned phrase.
+        """
+        self.bias: torch.Tensor = bias
+        self.prefixes: Dict[Tuple[int, ...], List[int]] = prefixes
+        self.prefix_lengths: List[int] = sorted({len(p) for p in prefixes})
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = scores + self.bias[:scores.shape[-1]]
+        if self.prefixes and input_ids.shape[1] > 0:
+            for row, ids in enumerate(input_ids[:, -self.prefix_lengths[-1]:].tolist()):
+                for length in self.prefix_lengths:
+                    banned = self.prefixes.get(tuple(ids[-length:])) if length <= len(ids) else None
+                    if banned:
+                        scores[row, banned] = -float('inf')
+        return scores
+
+
+class AI(Backend):
     """
     The class responsible for handling raw text-generation using a gpt-2 model.
     """
@@ -16,12 +252,16 @@ class AI(object):
             self,
             model_path=None,
             use_gpu=True,
+            precision='auto',
     ):
         assert model_path, "No model specified!"
+        assert precision == 'auto' or precision in precisions, f'Unknown precision "{precision}"!'
 
         self.model_path = str(model_path)
-        self.use_gpu = torch.cuda.is_available() and use_gpu
-        self.dtype = torch.float16
+        # quantized layers only run on the cpu
+        self.use_gpu = torch.cuda.is_available() and use_gpu and precision != 'int8'
+        self.precision = get_auto_precision(self.use_gpu) if precision == 'auto' else precision
+        self.dtype = precisions[self.precision]
         self.device = torch.device("cuda" if self.use_gpu else "cpu")
 
         seed = random.randint(0, 2147483647)
@@ -32,52 +272,699 @@ class AI(object):
         self.eos_token_id = self.tokenizer.encode('<|endoftext|>')[0]
 
         self.model = GPT2LMHeadModel.from_pretrained(self.model_path)
-        self.model.to(self.dtype).to(self.device)
         self.model.eval()
+        if self.precision == 'int8':
+            self.model = quantize_dynamic(self.model)
+        else:
+            self.model.to(self.dtype).to(self.device)
+        # quantized weights are packed, and only show up in the state dict
+        self.model_size: int = get_tensors_size(self.model.state_dict())
+        # Identifies the loaded model and precision, so key/value states saved by another one aren't used
+        self.fingerprint: str = f'{get_model_fingerprint(self.model_path)};{self.precision};{self.device.type}'
+
+        # Only one generation can run at a time, since they share the model and its cache
+        self.lock = threading.Lock()
+        # The token ids whose key/value states are currently held in `cache_past`
+        self.cache_ids: List[int] = []
+        self.cache_past: Any = None
+        # The compiled logits processor of each vocabulary used recently
+        self.vocabularies: Dict[Any, VocabularyLogitsProcessor] = {}
 
     @property
     def model_info(self) -> str:
-        return f'{self.dtype} precision model running on {"gpu" if self.use_gpu else "cpu"}'
+        return f'{self.precision} precision model running on {"gpu" if self.use_gpu else "cpu"}'
+
+    @property
+    def resident_size(self) -> int:
+        """
+        :return: The memory used by the model's weights and its key/value cache, in bytes.
+        """
+        return self.model_size + get_tensors_size(self.cache_past)
+
+    @property
+    def max_positions(self) -> int:
+        """
+        :return: The maximum number of token positions the model can attend to, including generated tokens.
+        """
+        return self.model.config.n_positions
+
+    def encode(self, text: str) -> List[int]:
+        """
+        :param text: The text to encode.
+        :return: The token ids of the given text.
+        """
+        return self.tokenizer.encode(text)
+
+    @torch.no_grad()
+    def evaluate(self, text: str, num_tokens: int = 60) -> Dict[str, Any]:
+        """
+        Measures the speed and output quality of the model, for comparing precisions.
+
+        :param text: The text to measure the perplexity of, which is also used as the input for measuring speed.
+        :param num_tokens: The number of tokens to generate when measuring speed.
+        :return: A dictionary of the time taken to prefill the text in milliseconds (`prefill_ms`), the number of
+        tokens generated per second (`tokens_per_sec`), the perplexity of the text (`perplexity`), and the most
+        likely next token after each position of the text (`predictions`).
+        """
+        input_ids = torch.tensor([self.encode(text)[-(self.max_positions - num_tokens):]], device=self.device)
+        # the first pass through a model is much slower than the rest
+        self.model(input_ids=input_ids[:, :1])
+        start = time.perf_counter()
+        outputs = self.model(input_ids=input_ids, use_cache=True)
+        prefill_time = time.perf_counter() - start
+        logits = outputs.logits[0].float()
+        loss = torch.nn.functional.cross_entropy(logits[:-1], input_ids[0, 1:])
+        past = outputs.past_key_values
+        next_id = logits[-1:].argmax(dim=-1, keepdim=True)
+        start = time.perf_counter()
+        for _ in range(num_tokens):
+            outputs = self.model(input_ids=next_id, past_key_values=past, use_cache=True)
+            past = outputs.past_key_values
+            next_id = outputs.logits[:, -1, :].argmax(dim=-1, keepdim=True)
+        decode_time = time.perf_counter() - start
+        return {
+            'prefill_ms': prefill_time * 1000.0,
+            'tokens_per_sec': num_tokens / decode_time if decode_time > 0 else 0.0,
+            'perplexity': loss.exp().item(),
+            'predictions': logits.argmax(dim=-1).tolist(),
+        }
+
+    def clear_cache(self) -> None:
+        """
+        Discards the cached key/value states from the previous generation.
+        """
+        self.cache_ids = []
+        self.cache_past = None
+
+    @torch.no_grad()
+    def save_prefix(self, token_ids: List[int], path: str) -> bool:
+        """
+        Prefills token ids and saves their key/value states to a file, so that `load_prefix` can skip prefilling
+        them later. Nothing is saved if the file already holds the up to date states of the same token ids.
+        The file is written to a temporary file first and then moved into place, so it is never left incomplete.
+
+        :param token_ids: The token ids to prefill, such as an adventure's context.
+        :param path: The file to save the key/value states to.
+        :return: `True` if the states were saved, `False` if the file was already up to date or there are too many
+        token ids for the model.
+        """
+        if not token_ids or len(token_ids) >= self.max_positions or self.read_prefix(token_ids, path) is not None:
+            return False
+        with self.lock:
+            outputs = self.model(input_ids=torch.tensor([token_ids], device=self.device), use_cache=True)
+        past = outputs.past_key_values
+        if hasattr(past, 'to_legacy_cache'):
+            past = past.to_legacy_cache()
+        temp_path = f'{path}.tmp'
+        torch.save({
+            'fingerprint': self.fingerprint,
+            'ids': torch.tensor(token_ids),
+            'keys': [layer[0].cpu() for layer in past],
+            'values': [layer[1].cpu() for layer in past],
+        }, temp_path)
+        os.replace(temp_path, path)
+        return True
+
+    def read_prefix(self, token_ids: List[int], path: str) -> Any:
+        """
+        :param token_ids: The token ids the states were saved for.
+        :param path: The file the states were saved to by `save_prefix`.
+        :return: The saved key/value states as legacy tuples, or `None` if the file is missing or unreadable, holds
+        the states of other token ids, or was saved by a different model or precision. The file is memory-mapped
+        rather than read, so on the cpu only the parts of it which are used are ever loaded into memory.
+        """
+        try:
+            snapshot = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+        except (OSError, RuntimeError, pickle.UnpicklingError):
+            return None
+        if snapshot.get('fingerprint') != self.fingerprint or snapshot['ids'].tolist() != token_ids:
+            return None
+        return tuple((k.to(self.device), v.to(self.device)) for k, v in zip(snapshot['keys'], snapshot['values']))
+
+    def load_prefix(self, token_ids: List[int], path: str) -> bool:
+        """
+        Loads key/value states saved by `save_prefix` into the cache, so that the next generation whose input
+        starts with the token ids only has to prefill the rest of its input.
+
+        :param token_ids: The token ids the states were saved for.
+        :param path: The file the states were saved to.
+        :return: `True` if the states were loaded, `False` if the file is missing, holds the states of other token
+        ids, or was saved by a different model or precision.
+        """
+        past = self.read_prefix(token_ids, path)
+        if past is None:
+            return False
+        with self.lock:
+            # a cache which already holds the same states, and more after them, is worth more than the snapshot
+            if self.cache_ids[:len(token_ids)] != token_ids:
+                self.cache_ids, self.cache_past = list(token_ids), past
+        return True
 
     def generate(
             self,
-            text: str,
+            text: Union[str, List[int]],
             max_length: int,
             beam_searches: int,
             temperature: float,
             top_k: float,
             top_p: float,
             repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[Union[StoppingCriterion, StoppingCriteria]]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
     ) -> str:
         """
         Generates a raw, unaltered string from a single input.
 
-        :param text: The text to use to generate the string.
+        :param text: The text to use to generate the string, or its already encoded token ids.
         :param max_length: The maximum length of string to generate.
         :param beam_searches: The number of beam searches to perform.
         :param temperature: The temperature used by the sampling algorithm.
         :param top_k: The top_k value used by the sampling algorithm.
         :param top_p: The top_p value used by the sampling algorithm.
         :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param callback: If given, called with each chunk of decoded text as soon as it is generated.
+        :param cancel_token: If given, used to stop the generation early.
+        :param stopping_criteria: Criteria checked after every decoding step which can end generation early, either
+        `StoppingCriterion`s, which stop single sequences, or the model's own `StoppingCriteria`.
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :param spans: If given, the number of tokens and the time spent prefilling and decoding are added to it.
+        :param use_cache: If `False`, the key/value cache kept from the previous generation is neither used nor
+        replaced, so that a generation unrelated to the story doesn't evict the story's prompt from it.
         :return: An unaltered string generated by the AI.
         """
-        input_ids = self.tokenizer.encode(text, return_tensors='pt')
-        input_ids = input_ids.to(self.device)
-        input_len = len(input_ids[0])
+        return self.generate_candidates(
+            text, 1, max_length, beam_searches, temperature, top_k, top_p, repetition_penalty,
+            callback, cancel_token, stopping_criteria, vocabulary, spans, use_cache,
+        )[0]
+
+    def generate_candidates(
+            self,
+            text: Union[str, List[int]],
+            num_candidates: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[Union[StoppingCriterion, StoppingCriteria]]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> List[str]:
+        """
+        Generates several alternative raw, unaltered strings from a single input in one batch.
+        The input is only prefilled once, and shared by all of the candidates.
+
+        :param text: The text to use to generate the strings, or its already encoded token ids.
+        :param num_candidates: The number of strings to generate. Beam searches can't return more strings than
+        there are beams.
+        :param max_length: The maximum length of string to generate.
+        :param beam_searches: The number of beam searches to perform.
+        :param temperature: The temperature used by the sampling algorithm.
+        :param top_k: The top_k value used by the sampling algorithm.
+        :param top_p: The top_p value used by the sampling algorithm.
+        :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param callback: If given, called with each chunk of decoded text of the first candidate as soon as it is
+        generated.
+        :param cancel_token: If given, used to stop the generation early.
+        :param stopping_criteria: Criteria checked after every decoding step which can end generation early, either
+        `StoppingCriterion`s, which stop single sequences, or the model's own `StoppingCriteria`.
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :param spans: If given, the number of tokens and the time spent prefilling and decoding are added to it.
+        :param use_cache: If `False`, the key/value cache kept from the previous generation is neither used nor
+        replaced, so that a generation unrelated to the story doesn't evict the story's prompt from it.
+        :return: A list of unaltered strings generated by the AI.
+        """
+        stopping_criteria = list(stopping_criteria or [])
+        if cancel_token:
+            stopping_criteria.append(CancelCriteria(cancel_token))
+        candidates: List[List[int]] = []
+
+        def first_candidate() -> Iterator[int]:
+            for step in steps:
+                if not candidates:
+                    candidates.extend([] for _ in step)
+                for c, token in zip(candidates, step):
+                    c.append(token)
+                if step[0] != self.eos_token_id:
+                    yield step[0]
+
+        with self.lock:
+            steps = self._generate_tokens(
+                text, num_candidates, max_length, beam_searches, temperature, top_k, top_p, repetition_penalty,
+                stopping_criteria, vocabulary, spans, use_cache,
+            )
+            for chunk in self._decode_chunks(first_candidate()):
+                if callback:
+                    callback(chunk)
+        candidates = candidates or [[]]
+        return [self.decode(c[:c.index(self.eos_token_id)] if self.eos_token_id in c else c) for c in candidates]
+
+    def stream(
+            self,
+            text: Union[str, List[int]],
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            stopping_criteria: Optional[List[Union[StoppingCriterion, StoppingCriteria]]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+    ) -> Iterator[str]:
+        """
+        Generates a raw, unaltered string from a single input, yielding it in chunks of decoded text as the tokens
+        are generated. Beam searches can only yield their result once it is complete.
+
+        :param text: The text to use to generate the string, or its already encoded token ids.
+        :param max_length: The maximum length of string to generate.
+        :param beam_searches: The number of beam searches to perform.
+        :param temperature: The temperature used by the sampling algorithm.
+        :param top_k: The top_k value used by the sampling algorithm.
+        :param top_p: The top_p value used by the sampling algorithm.
+        :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param stopping_criteria: Criteria checked after every decoding step which can end generation early, either
+        `StoppingCriterion`s, which stop single sequences, or the model's own `StoppingCriteria`.
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :return: An iterator over the chunks of the string generated by the AI.
+        """
+        with self.lock:
+            steps = self._generate_tokens(
+                text, 1, max_length, beam_searches, temperature, top_k, top_p, repetition_penalty, stopping_criteria,
+                vocabulary,
+            )
+            yield from self._decode_chunks(step[0] for step in steps if step[0] != self.eos_token_id)
+
+    @torch.no_grad()
+    def generate_batch(self, requests: List[Dict[str, Any]]) -> List[List[str]]:
+        """
+        Generates candidates for several independent inputs as one padded batch, each with its own sampling
+        parameters. Sequences leave the batch as soon as they finish, so the remaining ones decode faster.
+        The key/value cache of the previous generation is neither used nor changed.
+
+        :param requests: The keyword arguments of `generate_candidates` for each input, except `beam_searches`,
+        since beam searches can't be batched.
+        :return: The list of unaltered strings generated for each input.
+        """
+        rows = [i for i, r in enumerate(requests) for _ in range(r.get('num_candidates', 1))]
+        max_lengths = [min(r['max_length'], self.max_positions - 1) for r in requests]
+        # the padded inputs and outputs of every row must fit the model's positional embeddings together
+        input_len = self.max_positions - max(max_lengths)
+        inputs = [(self.encode(r['text']) if isinstance(r['text'], str) else list(r['text']))[-input_len:]
+                  for r in requests]
+        width = max(len(ids) for ids in inputs)
+        padding = [width - len(inputs[i]) for i in rows]
+        sequence = torch.tensor(
+            [[self.eos_token_id] * p + inputs[i] for i, p in zip(rows, padding)], device=self.device
+        )
+        attention_mask = torch.tensor([[0] * p + [1] * (width - p) for p in padding], device=self.device)
+        processors = [
+            self.get_logits_processors(
+                r['temperature'], r['top_k'], r['top_p'], r['repetition_penalty'],
+                self.get_vocabulary_processor(r.get('vocabulary')),
+            )
+            for r in requests
+        ]
+        criteria = [
+            self.get_stopping_criteria(r.get('stopping_criteria'), len(ids)) for r, ids in zip(requests, inputs)
+        ]
+        for c, r in zip(criteria, requests):
+            if r.get('cancel_token'):
+                c.append(CancelCriteria(r['cancel_token']))
+        # the first row of each request is the one streamed to its callback
+        first_rows = {i: rows.index(i) for i in range(len(requests))}
+        outputs: List[List[int]] = [[] for _ in rows]
+        streamed = [''] * len(requests)
+
+        def stream(i: int, final: bool = False) -> None:
+            callback = requests[i].get('callback')
+            chunk = self._decode_chunk(outputs[first_rows[i]], streamed[i], final) if callback else ''
+            if chunk:
+                streamed[i] += chunk
+                callback(chunk)
+
+        # the original row of each sequence still in the batch
+        active = list(range(len(rows)))
+        step_ids = sequence
+        past = None
+        prefill_time = decode_time = 0.0
+        with self.lock:
+            while active:
+                start = time.perf_counter()
+                position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -step_ids.shape[1]:]
+                model_outputs = self.model(
+                    input_ids=step_ids,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=past,
+                    use_cache=True,
+                )
+                past = model_outputs.past_key_values
+                logits = model_outputs.logits[:, -1, :].float()
+                next_ids = torch.empty((len(active), 1), dtype=torch.long, device=self.device)
+                for b, row in enumerate(active):
+                    scores = processors[rows[row]](sequence[b:b+1, padding[row]:], logits[b:b+1])
+                    next_ids[b] = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)[0]
+                sequence = torch.cat([sequence, next_ids], dim=-1)
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(active), 1))], dim=-1)
+                keep = []
+                for b, row in enumerate(active):
+                    i = rows[row]
+                    token = next_ids[b, 0].item()
+                    if token == self.eos_token_id or len(outputs[row]) >= max_lengths[i]:
+                        continue
+                    outputs[row].append(token)
+                    if row == first_rows[i]:
+                        stream(i)
+                    finished = criteria[i](sequence[b:b+1, padding[row]:], logits[b:b+1]).all()
+                    if len(outputs[row]) < max_lengths[i] and not finished:
+                        keep.append(b)
+                if len(keep) < len(active):
+                    indices = torch.tensor(keep, dtype=torch.long, device=self.device)
+                    sequence = sequence.index_select(0, indices)
+                    attention_mask = attention_mask.index_select(0, indices)
+                    next_ids = next_ids.index_select(0, indices)
+                    past = select_past(past, indices) if keep else None
+                    active = [active[b] for b in keep]
+                step_ids = next_ids
+                if prefill_time == 0.0:
+                    prefill_time = time.perf_counter() - start
+                else:
+                    decode_time += time.perf_counter() - start
+        for i in range(len(requests)):
+            stream(i, final=True)
+            spans = requests[i].get('spans')
+            if spans is not None:
+                # the whole batch's time, since its sequences are prefilled and decoded together
+                num_tokens = len(outputs[first_rows[i]])
+                spans.add('tokens_in', len(inputs[i]))
+                spans.add('tokens_out', num_tokens)
+                spans.add('tokens_decoded', max(0, num_tokens - 1))
+                spans.add('tokens_generated', sum(len(o) for o, r in zip(outputs, rows) if r == i))
+                spans.add('prefill_ms', prefill_time * 1000.0)
+                spans.add('decode_ms', decode_time * 1000.0)
+        results: List[List[str]] = [[] for _ in requests]
+        for i, output_ids in zip(rows, outputs):
+            results[i].append(self.decode(output_ids))
+        return results
+
+    def _decode_chunks(self, tokens: Iterable[int]) -> Iterator[str]:
+        """
+        Decodes generated tokens incrementally.
+
+        :param tokens: The generated token ids.
+        :return: An iterator over the newly decoded text after each token.
+        """
+        output_ids = []
+        output_text = ''
+        for token in tokens:
+            output_ids.append(token)
+            chunk = self._decode_chunk(output_ids, output_text)
+            if chunk:
+                output_text += chunk
+                yield chunk
+        chunk = self._decode_chunk(output_ids, output_text, final=True)
+        if chunk:
+            yield chunk
+
+    def _decode_chunk(self, output_ids: List[int], output_text: str, final: bool = False) -> str:
+        """
+        :param output_ids: All of the token ids generated so far.
+        :param output_text: The text decoded so far.
+        :param final: Whether generation has ended, so no text should be held back anymore.
+        :return: The newly decoded text after the given text, which is empty if there is none yet.
+        """
+        text = self.decode(output_ids)
+        # a character split across several byte-level tokens can't be shown until all of them are generated
+        if not final and text.endswith('\ufffd'):
+            return ''
+        return text[len(output_text):]
+
+    def decode(self, token_ids: List[int]) -> str:
+        """
+        :param token_ids: The token ids to decode.
+        :return: The decoded text, without any special tokens.
+        """
+        return self.tokenizer.decode(
+            token_ids,
+            clean_up_tokenization_spaces=False,
+            skip_special_tokens=True,
+        )
+
+    @staticmethod
+    def get_logits_processors(
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            vocabulary_processor: Optional[LogitsProcessor] = None,
+    ) -> LogitsProcessorList:
+        """
+        Builds the logits processors used when sampling, mirroring the ones the model's own `generate` would use.
+
+        :param temperature: The temperature used by the sampling algorithm.
+        :param top_k: The top_k value used by the sampling algorithm. 0 or less disables it.
+        :param top_p: The top_p value used by the sampling algorithm. 1.0 or more disables it.
+        :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param vocabulary_processor: If given, applied first, so the temperature scales its biases too.
+        :return: The list of logits processors.
+        """
+        processors = LogitsProcessorList()
+        if vocabulary_processor is not None:
+            processors.append(vocabulary_processor)
+        if repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        if temperature != 1.0:
+            processors.append(TemperatureLogitsWarper(temperature))
+        if top_k > 0:
+            processors.append(TopKLogitsWarper(int(top_k)))
+        if top_p < 1.0:
+            processors.append(TopPLogitsWarper(top_p))
+        return processors
+
+    def get_vocabulary_processor(self, vocabulary: Optional[Vocabulary]) -> Optional[VocabularyLogitsProcessor]:
+        """
+        Compiles a vocabulary for this model's tokenizer, or reuses it if it was compiled before.
+
+        :param vocabulary: The words and phrases to bias or ban.
+        :return: The logits processor which applies the vocabulary, or `None` if it is empty.
+        """
+        if not vocabulary:
+            return None
+        key = vocabulary.key
+        processor = self.vocabularies.get(key)
+        if processor is not None:
+            return processor
+        bias = torch.zeros(self.model.config.vocab_size)
+        for word, value in vocabulary.biases.items():
+            tokens = {ids[0] for ids in map(self.encode, Vocabulary.get_variants(word)) if ids}
+            # a leading space which is a token of its own starts far more than the word
+            for token in (t for t in tokens if self.decode([t]).strip()):
+                bias[token] += value
+        prefixes: Dict[Tuple[int, ...], List[int]] = {}
+        for word in vocabulary.bans:
+            for ids in map(self.encode, Vocabulary.get_variants(word)):
+                if len(ids) == 1:
+                    bias[ids[0]] = -float('inf')
+                elif ids:
+                    prefixes.setdefault(tuple(ids[:-1]), []).append(ids[-1])
+        processor = VocabularyLogitsProcessor(bias.to(self.device), prefixes)
+        if len(self.vocabularies) >= 8:
+            # vocabularies only change when modules are edited, so the old ones won't be used again
+            self.vocabularies.clear()
+        self.vocabularies[key] = processor
+        return processor
+
+    def get_stopping_criteria(
+            self,
+            criteria: Optional[List[Union[StoppingCriterion, StoppingCriteria]]],
+            input_len: int,
+    ) -> StoppingCriteriaList:
+        """
+        :param criteria: The criteria of a generation, either `StoppingCriterion`s or the model's own
+        `StoppingCriteria`.
+        :param input_len: The number of input tokens before the generated ones.
+        :return: The criteria, as the model's `StoppingCriteria`.
+        """
+        criteria = criteria or []
+        result = StoppingCriteriaList(c for c in criteria if not isinstance(c, StoppingCriterion))
+        token_criteria = [c for c in criteria if isinstance(c, StoppingCriterion)]
+        if token_criteria:
+            result.append(TokenStoppingCriteria(token_criteria, input_len, self.decode))
+        return result
+
+    def _generate_tokens(
+            self,
+            text: Union[str, List[int]],
+            num_sequences: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            stopping_criteria: Optional[List[Union[StoppingCriterion, StoppingCriteria]]],
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> Iterator[List[int]]:
+        """
+        Generates tokens for one or more sequences from a single input.
+
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :param spans: If given, the number of tokens and the time spent prefilling and decoding are added to it.
+        :param use_cache: If `False`, the key/value cache is neither used nor replaced.
+        :return: An iterator over the generated token id of every sequence, for each decoding step.
+        Sequences which have finished are padded with the end of text token.
+        """
+        input_ids = self.encode(text) if isinstance(text, str) else list(text)
+        # never let the input and output overflow the model's positional embeddings
+        max_length = min(max_length, self.max_positions - 1)
+        input_ids = input_ids[-(self.max_positions - max_length):]
+        stopping_criteria = self.get_stopping_criteria(stopping_criteria, len(input_ids))
+        vocabulary_processor = self.get_vocabulary_processor(vocabulary)
+        if spans is not None:
+            spans.add('tokens_in', len(input_ids))
+        if beam_searches > 1:
+            start = time.perf_counter()
+            sequences = self._generate_beams(
+                input_ids, num_sequences, max_length, beam_searches, temperature, top_k, top_p,
+                repetition_penalty, stopping_criteria, vocabulary_processor,
+            )
+            if spans is not None:
+                # beam searches can't be split into prefilling and decoding
+                spans.add('beam_search_ms', (time.perf_counter() - start) * 1000.0)
+                spans.add('tokens_out', len(sequences[0]) if sequences else 0)
+                spans.add('tokens_generated', sum(len(s) - s.count(self.eos_token_id) for s in sequences))
+            return (list(step) for step in zip(*sequences))
+        return self._generate_sampled(
+            input_ids, num_sequences, max_length, temperature, top_k, top_p, repetition_penalty,
+            stopping_criteria, vocabulary_processor, spans, use_cache,
+        )
+
+    def _generate_beams(
+            self,
+            input_ids: List[int],
+            num_sequences: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            stopping_criteria: StoppingCriteriaList,
+            vocabulary_processor: Optional[VocabularyLogitsProcessor] = None,
+    ) -> List[List[int]]:
+        """
+        Generates tokens using the model's own beam search. The key/value cache is not used.
+
+        :return: The generated token ids of each sequence, not including the input ids.
+        """
+        input_len = len(input_ids)
         result = self.model.generate(
-            input_ids=input_ids,
+            input_ids=torch.tensor([input_ids], device=self.device),
             min_length=input_len,
             max_length=input_len+max_length,
             do_sample=True,
             num_beams=beam_searches,
+            num_return_sequences=min(num_sequences, beam_searches),
             temperature=temperature,
             top_p=top_p,
-            top_k=top_k,
+            top_k=max(int(top_k), 0),
             repetition_penalty=repetition_penalty,
             eos_token_id=self.eos_token_id,
+            pad_token_id=self.eos_token_id,
+            stopping_criteria=stopping_criteria,
+            logits_processor=LogitsProcessorList([vocabulary_processor] if vocabulary_processor else []),
         )
-        return self.tokenizer.decode(
-            result[0][input_len:],
-            clean_up_tokenization_spaces=False,
-            skip_special_tokens=True,
-        )
+        return result[:, input_len:].tolist()
+
+    @torch.no_grad()
+    def _generate_sampled(
+            self,
+            input_ids: List[int],
+            num_sequences: int,
+            max_length: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            stopping_criteria: StoppingCriteriaList,
+            vocabulary_processor: Optional[VocabularyLogitsProcessor] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> Iterator[List[int]]:
+        """
+        Generates tokens by sampling, reusing the cached key/value states of the longest token prefix shared with
+        the previous generation, so that only the new part of the input has to be prefilled.
+        Several sequences are sampled as one batch which shares the prefilled input.
+
+        :param spans: If given, the number of input tokens found in the cache, and the time spent prefilling and
+        decoding, are added to it. "tokens_out" counts the tokens of the first sequence, and "tokens_generated"
+        those of every sequence. The time the caller spends between steps is not included.
+        :param use_cache: If `False`, the whole input is prefilled, and the cache is left as it was.
+        :return: An iterator over the generated token id of every sequence, for each decoding step.
+        """
+        processors = self.get_logits_processors(temperature, top_k, top_p, repetition_penalty, vocabulary_processor)
+        past, cache_ids = None, []
+        if use_cache:
+            # take ownership of the cache, so an interrupted generation leaves it empty rather than inconsistent
+            past, cache_ids = self.cache_past, self.cache_ids
+            self.clear_cache()
+        prefix_len = 0
+        # at least one input token must be prefilled to get the logits for the next token
+        for a, b in zip(cache_ids, input_ids[:-1]):
+            if a != b:
+                break
+            prefix_len += 1
+        past = crop_past(past, prefix_len) if prefix_len > 0 else None
+        if spans is not None:
+            spans.add('tokens_cached', prefix_len)
+
+        sequence = torch.tensor([input_ids], device=self.device)
+        step_ids = sequence[:, prefix_len:]
+        finished = torch.zeros(num_sequences, dtype=torch.bool, device=self.device)
+        try:
+            for step in range(max_length):
+                start = time.perf_counter()
+                outputs = self.model(input_ids=step_ids, past_key_values=past, use_cache=True)
+                past = outputs.past_key_values
+                logits = outputs.logits[:, -1, :].float()
+                if step == 0 and num_sequences > 1:
+                    # only the input is shared between the sequences, so only it is kept in the cache
+                    if use_cache:
+                        self.cache_ids, self.cache_past = input_ids, past
+                    past = expand_past(past, num_sequences)
+                    sequence = sequence.repeat(num_sequences, 1)
+                    logits = logits.repeat(num_sequences, 1)
+                scores = processors(sequence, logits)
+                next_ids = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)
+                next_ids[finished] = self.eos_token_id
+                finished |= next_ids[:, 0] == self.eos_token_id
+                sequence = torch.cat([sequence, next_ids], dim=-1)
+                step_ids = next_ids
+                # copying the tokens to the cpu waits for the step to finish, so it is timed completely
+                step_tokens = next_ids[:, 0].tolist()
+                if spans is not None:
+                    spans.add('prefill_ms' if step == 0 else 'decode_ms', (time.perf_counter() - start) * 1000.0)
+                    spans.add('tokens_out', 1)
+                    spans.add('tokens_generated', sum(t != self.eos_token_id for t in step_tokens))
+                    if step > 0:
+                        spans.add('tokens_decoded', 1)
+                yield step_tokens
+                # sequences stopped by a criterion are finished, and padded like the ones which ended
+                finished |= stopping_criteria(sequence, scores)
+                if finished.all():
+                    break
+        finally:
+            # also keeps the cache when the caller stops iterating early
+            if use_cache and num_sequences == 1:
+                self.cache_ids = sequence[0, :get_past_length(past)].tolist()
+                self.cache_past = past
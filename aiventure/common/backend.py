@@ -0,0 +1,189 @@
+from typing import *
+import time
+
+from aiventure.common.metrics import Spans
+from aiventure.common.stopping import StoppingCriterion
+from aiventure.common.vocabulary import Vocabulary
+
+
+class CancelToken(object):
+    """
+    Stops a generation cooperatively, between decoding steps, once a deadline passes or once it is cancelled from
+    another thread. The text generated until then is kept.
+    """
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        :param timeout: How long generation may run for, in seconds. `None` or 0 or less for no deadline.
+        """
+        self.deadline: Optional[float] = time.monotonic() + timeout if timeout and timeout > 0 else None
+        self.cancelled: bool = False
+        self.timed_out: bool = False
+
+    @property
+    def stopped(self) -> bool:
+        return self.cancelled or self.timed_out
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """
+        :return: The number of seconds left until the deadline, or `None` if there is no deadline.
+        """
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self) -> None:
+        """
+        Stops the generation this token was given to after its current decoding step.
+        """
+        self.cancelled = True
+
+    def check(self) -> bool:
+        """
+        Checks whether the generation this token was given to should stop.
+
+        :return: `True` if it was cancelled or its deadline has passed, `False` otherwise.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.timed_out = True
+        return self.stopped
+
+
+class Backend(object):
+    """
+    The interface of everything that can generate text for an adventure, whether it runs the model in-process or
+    somewhere else.
+    """
+    # The precision the model is running in
+    precision: str = 'auto'
+
+    @property
+    def model_info(self) -> str:
+        """
+        :return: A short description of the model, for showing to the user.
+        """
+        raise NotImplementedError()
+
+    @property
+    def resident_size(self) -> int:
+        """
+        :return: The memory used by the model in this process, in bytes.
+        """
+        raise NotImplementedError()
+
+    @property
+    def max_positions(self) -> int:
+        """
+        :return: The maximum number of token positions the model can attend to, including generated tokens.
+        """
+        raise NotImplementedError()
+
+    def encode(self, text: str) -> List[int]:
+        """
+        :param text: The text to encode.
+        :return: The token ids of the given text.
+        """
+        raise NotImplementedError()
+
+    def save_prefix(self, token_ids: List[int], path: str) -> bool:
+        """
+        Prefills token ids and saves their key/value states to a file, so that `load_prefix` can skip prefilling
+        them later. Nothing is saved if the file already holds the up to date states of the same token ids.
+
+        :param token_ids: The token ids to prefill, such as an adventure's context.
+        :param path: The file to save the key/value states to.
+        :return: `True` if the states were saved, `False` if the file was already up to date or the backend can't
+        save its states.
+        """
+        return False
+
+    def load_prefix(self, token_ids: List[int], path: str) -> bool:
+        """
+        Loads key/value states saved by `save_prefix`, so that the next generation whose input starts with the
+        token ids only has to prefill the rest of its input.
+
+        :param token_ids: The token ids the states were saved for.
+        :param path: The file the states were saved to.
+        :return: `True` if the states were loaded, `False` if the file is missing, holds the states of other token
+        ids, was saved by a different model or precision, or the backend can't load states.
+        """
+        return False
+
+    def generate(
+            self,
+            text: Union[str, List[int]],
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[StoppingCriterion]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> str:
+        """
+        Generates a raw, unaltered string from a single input.
+
+        :param text: The text to use to generate the string, or its already encoded token ids.
+        :param max_length: The maximum length of string to generate.
+        :param beam_searches: The number of beam searches to perform.
+        :param temperature: The temperature used by the sampling algorithm.
+        :param top_k: The top_k value used by the sampling algorithm.
+        :param top_p: The top_p value used by the sampling algorithm.
+        :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param callback: If given, called with each chunk of decoded text as soon as it is generated.
+        :param cancel_token: If given, used to stop the generation early.
+        :param stopping_criteria: Criteria checked after every decoding step which can end a sequence early.
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :param spans: If given, the number of tokens and the time spent prefilling and decoding are added to it.
+        :param use_cache: If `False`, the key/value cache kept from the previous generation is neither used nor
+        replaced, so that a generation unrelated to the story doesn't evict the story's prompt from it.
+        :return: An unaltered string generated by the AI.
+        """
+        return self.generate_candidates(
+            text, 1, max_length, beam_searches, temperature, top_k, top_p, repetition_penalty,
+            callback, cancel_token, stopping_criteria, vocabulary, spans, use_cache,
+        )[0]
+
+    def generate_candidates(
+            self,
+            text: Union[str, List[int]],
+            num_candidates: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[StoppingCriterion]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> List[str]:
+        """
+        Generates several alternative raw, unaltered strings from a single input in one batch.
+
+        :param text: The text to use to generate the strings, or its already encoded token ids.
+        :param num_candidates: The number of strings to generate. Beam searches can't return more strings than
+        there are beams.
+        :param max_length: The maximum length of string to generate.
+        :param beam_searches: The number of beam searches to perform.
+        :param temperature: The temperature used by the sampling algorithm.
+        :param top_k: The top_k value used by the sampling algorithm.
+        :param top_p: The top_p value used by the sampling algorithm.
+        :param repetition_penalty: The repetition penalty. 1.0 is no penalty.
+        :param callback: If given, called with each chunk of decoded text of the first candidate as soon as it is
+        generated.
+        :param cancel_token: If given, used to stop the generation early.
+        :param stopping_criteria: Criteria checked after every decoding step which can end a sequence early.
+        :param vocabulary: If given, the words and phrases to bias or ban.
+        :param spans: If given, the number of tokens and the time spent prefilling and decoding are added to it.
+        :param use_cache: If `False`, the key/value cache kept from the previous generation is neither used nor
+        replaced, so that a generation unrelated to the story doesn't evict the story's prompt from it.
+        :return: A list of unaltered strings generated by the AI.
+        """
+        raise NotImplementedError()
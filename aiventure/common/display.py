@@ -0,0 +1,194 @@
+from typing import *
+import bisect
+
+from aiventure.common.adventure import StoryView
+
+
+class DisplayCache(object):
+    """
+    Renders a story for display one entry at a time, keeping the rendered fragment of every entry. An entry is only
+    rendered again when its version, or the version of the entry before it, changes, so a new turn only renders the
+    new entries.
+
+    Entries are only ever changed in place by edits, which the story records, or removed and added at the end, so
+    the changed entries are found without comparing every version. The story's record of edits is cleared once they
+    are rendered, so it doesn't keep growing. The fragments are also kept joined into
+    paragraphs, of which only the ones from the first changed fragment on are joined again.
+    """
+    def __init__(self, filter_entry: Callable[[str, int, Optional[str]], str]):
+        """
+        :param filter_entry: The display filter of a single entry. Given the entry, its index in the story and the
+        previous entry (or `None`), it returns the entry's display string, including its separator from the
+        previous entry.
+        """
+        self.filter_entry: Callable[[str, int, Optional[str]], str] = filter_entry
+        self.versions: List[int] = []
+        self.fragments: List[str] = []
+        # The number of entries before the story, and the story's record of edits
+        self.head_length: int = 0
+        self.edits: Optional[List[int]] = None
+        # The display string of each paragraph, and the index of the fragment each starts at
+        self.paragraphs: List[str] = []
+        self.starts: List[int] = []
+        # The first paragraph which changed since the paragraphs were last returned
+        self.changed: int = 0
+        # Whether an extra entry was returned along with the paragraphs last time
+        self.extended: bool = False
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        """
+        :return: The display string of the whole story, as it was last rendered.
+        """
+        if self._text is None:
+            self._text = ''.join(self.fragments)
+        return self._text
+
+    def clear(self) -> None:
+        """
+        Discards all of the rendered fragments.
+        """
+        self.versions = []
+        self.fragments = []
+        self.edits = None
+        self.paragraphs = []
+        self.starts = []
+        self.changed = 0
+        self._text = None
+
+    def update(self, story: StoryView) -> int:
+        """
+        Renders the entries of a story which changed since the last time.
+
+        :param story: The story to render.
+        :return: The index of the first fragment which changed, or the number of fragments if none did.
+        """
+        versions = self.versions
+        length = len(story)
+        old_length = len(versions)
+        head_length = len(story.head)
+        end = min(old_length, length)
+        changed = set()
+        if head_length != self.head_length:
+            # every entry has a new index
+            end = 0
+        elif story.edits is None or story.edits is not self.edits:
+            # a different story, which can only be compared entry by entry
+            end = next((i for i in range(end) if versions[i] != story.get_version(i)), end)
+        else:
+            # added entries always have newer versions than the removed ones they replace
+            while end > head_length and versions[end - 1] != story.get_version(end - 1):
+                end -= 1
+            for i in range(head_length):
+                if versions[i] != story.get_version(i):
+                    changed.update((i, i + 1))
+            for position in story.edits:
+                changed.update((head_length + position, head_length + position + 1))
+        changed = sorted(i for i in changed if i < end)
+        del versions[end:]
+        del self.fragments[end:]
+        for i in changed:
+            versions[i] = story.get_version(i)
+            self.fragments[i] = self.render_entry(story, i)
+        for i in range(end, length):
+            versions.append(story.get_version(i))
+            self.fragments.append(self.render_entry(story, i))
+        self.head_length = head_length
+        self.edits = story.edits
+        if story.edits is not None:
+            # every edit has been rendered
+            story.edits.clear()
+        first = changed[0] if changed else end
+        if first < length or length != old_length:
+            self._text = None
+        return first
+
+    def render(self, story: StoryView, extra: Optional[str] = None) -> str:
+        """
+        Renders a story, only rendering the entries which changed since the last time.
+
+        :param story: The story to render.
+        :param extra: If given, an entry to render after the story without caching it, such as a result which is
+        still being generated.
+        :return: The display string of the whole story.
+        """
+        self.update(story)
+        if extra is None:
+            return self.text
+        return self.text + self.render_extra(story, extra)
+
+    def render_paragraphs(self, story: StoryView, extra: Optional[str] = None) -> Tuple[int, List[str]]:
+        """
+        Renders a story like `render`, split into paragraphs where an entry is separated from the previous one by
+        a blank line. An entry is never split across paragraphs.
+
+        :param story: The story to render.
+        :param extra: If given, an entry to render after the story without caching it.
+        :return: The index of the first paragraph which changed since the paragraphs were last returned, and the
+        display string of every paragraph from it on.
+        """
+        old_length = len(self.fragments)
+        first = self.update(story)
+        if first < old_length or len(self.fragments) != old_length:
+            self.join_paragraphs(first, old_length)
+        start = self.changed
+        if (extra is not None or self.extended) and self.paragraphs:
+            # the extra entry may have been joined to the last paragraph
+            start = min(start, len(self.paragraphs) - 1)
+        paragraphs = self.paragraphs[start:]
+        fragment = self.render_extra(story, extra) if extra is not None else ''
+        if fragment:
+            if not self.paragraphs or fragment.startswith('\n\n'):
+                paragraphs.append(fragment.lstrip())
+            else:
+                paragraphs[-1] += fragment
+        self.changed = len(self.paragraphs)
+        self.extended = extra is not None
+        return start, paragraphs
+
+    def join_paragraphs(self, first: int, old_length: int) -> None:
+        """
+        Joins the fragments into paragraphs again, from the paragraph holding the first changed fragment on.
+
+        :param first: The index of the first fragment which changed.
+        :param old_length: The number of fragments before they changed.
+        """
+        p = bisect.bisect_right(self.starts, first) - 1
+        if first >= old_length and p >= 0:
+            # fragments were only added, so they are joined onto the paragraphs as they are
+            index = old_length
+        else:
+            if p > 0 and self.starts[p] == first:
+                # the changed fragment may not start a paragraph anymore
+                p -= 1
+            # fragments before the first paragraph are empty, but may not be anymore
+            p, index = (p, self.starts[p]) if p >= 0 else (0, 0)
+            del self.paragraphs[p:]
+            del self.starts[p:]
+        self.changed = min(self.changed, p)
+        for i in range(index, len(self.fragments)):
+            fragment = self.fragments[i]
+            if not fragment:
+                continue
+            if not self.paragraphs or fragment.startswith('\n\n'):
+                self.paragraphs.append(fragment.lstrip())
+                self.starts.append(i)
+            else:
+                self.paragraphs[-1] += fragment
+
+    def render_entry(self, story: StoryView, index: int) -> str:
+        """
+        :param story: The story the entry is in.
+        :param index: The index of the entry.
+        :return: The display string of the entry.
+        """
+        return self.filter_entry(story[index], index, story[index - 1] if index > 0 else None)
+
+    def render_extra(self, story: StoryView, extra: str) -> str:
+        """
+        :param story: The story the entry follows.
+        :param extra: The entry to render after the story.
+        :return: The display string of the entry.
+        """
+        return self.filter_entry(extra, len(story), story[-1] if len(story) > 0 else None)
@@ -0,0 +1,140 @@
+from typing import *
+import json
+import os
+
+from aiventure.common.adventure import Adventure
+
+
+class Journal(object):
+    """
+    Saves an adventure as a snapshot, followed by an append-only journal of the changes made to it since.
+    Saving only appends the changes made since the last save, so it takes time proportional to the changes rather
+    than to the whole adventure. Once the journal grows long enough, it is compacted into a new snapshot.
+
+    The snapshot ("{path}.json") is the adventure's `to_dict`, plus the sequence number of the last change it
+    includes. The journal ("{path}.journal") holds one JSON change per line, each with its sequence number, so that
+    changes already in the snapshot are skipped if saving was interrupted before the journal was cleared.
+
+    The adventure's passage index is written next to the snapshot ("{path}.index") when it is compacted, and only
+    loaded once the index is needed, so it doesn't slow down loading. Entries changed since are reindexed then.
+    """
+    def __init__(self, path: str, compact_every: int = 200):
+        """
+        :param path: The path of the save, without an extension.
+        :param compact_every: The number of changes the journal may hold before it is compacted.
+        """
+        self.path: str = path
+        self.compact_every: int = compact_every
+        # The sequence number of the last change saved
+        self.seq: int = 0
+        # The number of changes in the journal, since the snapshot
+        self.length: int = 0
+        # Whether the save on disk is known to match the adventure as it was when it was last saved or loaded
+        self.synced: bool = False
+
+    @property
+    def snapshot_path(self) -> str:
+        return f'{self.path}.json'
+
+    @property
+    def journal_path(self) -> str:
+        return f'{self.path}.journal'
+
+    @property
+    def index_path(self) -> str:
+        return f'{self.path}.index'
+
+    def load(self, adventure: Adventure) -> None:
+        """
+        Loads an adventure from its snapshot, and replays the journalled changes on top of it.
+        A change which was only partially written, because saving was interrupted, is ignored.
+
+        :param adventure: The adventure to load into.
+        """
+        with open(self.snapshot_path, 'r') as json_file:
+            data = json.load(json_file)
+        adventure.from_dict(data)
+        if os.path.isfile(self.index_path):
+            adventure.index_path = self.index_path
+        self.seq = data.get('seq', 0)
+        self.length = 0
+        # changes appended after a partially written one would never be replayed, so the next save compacts
+        self.synced = True
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        self.synced = False
+                        break
+                    self.length += 1
+                    seq = change.pop('seq')
+                    if seq > self.seq:
+                        adventure.apply_change(change)
+                        self.seq = seq
+        adventure.changes = []
+
+    def save(self, adventure: Adventure) -> None:
+        """
+        Saves the changes made to an adventure since it was last saved or loaded.
+
+        :param adventure: The adventure to save.
+        """
+        if not self.synced or adventure.changes is None \
+                or self.length + len(adventure.changes) > self.compact_every:
+            self.compact(adventure)
+            return
+        lines = []
+        for change in adventure.changes:
+            self.seq += 1
+            lines.append(json.dumps({**change, 'seq': self.seq}) + '\n')
+        with open(self.journal_path, 'a') as journal_file:
+            journal_file.writelines(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.length += len(lines)
+        adventure.changes = []
+
+    def compact(self, adventure: Adventure) -> None:
+        """
+        Saves an adventure in full as a new snapshot, and clears the journal.
+        The snapshot is written to a temporary file first and then moved into place, and the journal is only
+        removed after that, so the previous save stays intact if writing is interrupted.
+
+        :param adventure: The adventure to save.
+        """
+        if not self.synced:
+            # the journal may hold changes which aren't in the adventure, so the snapshot must skip all of them
+            # in case it can't be removed once the snapshot is written
+            self.seq = max(self.seq, self.get_last_seq())
+        self.seq += len(adventure.changes or [])
+        temp_path = f'{self.snapshot_path}.tmp'
+        with open(temp_path, 'w') as json_file:
+            json.dump({**adventure.to_dict(), 'seq': self.seq}, json_file)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        # only saved if it has been built, rather than building it just to save it
+        with adventure.index_lock:
+            if adventure.entries and len(adventure.index) == len(adventure.entries):
+                adventure.index.save(self.index_path)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.length = 0
+        self.synced = True
+        adventure.changes = []
+
+    def get_last_seq(self) -> int:
+        """
+        :return: The largest sequence number in the journal, or 0 if it is empty or missing.
+        """
+        seq = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        seq = max(seq, json.loads(line)['seq'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        return seq
@@ -0,0 +1,117 @@
+from typing import *
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import time
+
+
+class Spans(object):
+    """
+    The timings and counts of a single turn. Timed spans are recorded in milliseconds as "{name}_ms", and spans
+    with the same name add up. Recording only costs a couple of clock reads, so turns can always be measured.
+    """
+    def __init__(self):
+        self.start: float = time.perf_counter()
+        self.values: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Times the code run inside the `with` block, even if it raises.
+
+        :param name: The name of the span.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f'{name}_ms', (time.perf_counter() - start) * 1000.0)
+
+    def add(self, name: str, value: float) -> None:
+        """
+        :param name: The name of the value.
+        :param value: The amount to add to the value, which starts at 0.
+        """
+        self.values[name] = self.values.get(name, 0) + value
+
+    def finish(self) -> Dict[str, float]:
+        """
+        Records the total time of the turn, and the number of tokens decoded per second if the AI reported it.
+
+        :return: All of the values recorded for the turn.
+        """
+        self.values['total_ms'] = (time.perf_counter() - self.start) * 1000.0
+        decode_ms = self.values.get('decode_ms', 0)
+        if decode_ms > 0:
+            self.values['decode_tokens_per_sec'] = self.values.get('tokens_decoded', 0) * 1000.0 / decode_ms
+        return self.values
+
+
+class MetricsLog(object):
+    """
+    Writes the values of every turn to a rolling JSON lines file ("{path}.jsonl"), which is moved aside to
+    "{path}.jsonl.1" once it grows too large, and keeps a summary of the recent turns in the Prometheus text format
+    ("{path}.prom") for scraping through a textfile collector.
+    """
+    def __init__(self, path: str, max_size: int = 1024 * 1024, window: int = 100, prefix: str = 'aiventure_turn'):
+        """
+        :param path: The path of the metrics files, without an extension.
+        :param max_size: The size in bytes the JSON lines file may grow to before it is rolled over.
+        :param window: The number of recent turns the quantiles in the summary are taken over.
+        :param prefix: The prefix of the Prometheus metric names.
+        """
+        self.path: str = path
+        self.max_size: int = max_size
+        self.prefix: str = prefix
+        self.window: int = window
+        self.size: int = os.path.getsize(self.jsonl_path) if os.path.isfile(self.jsonl_path) else 0
+        # The number of turns and the total of each value since the log was opened, and the recent values
+        self.counts: Dict[str, int] = {}
+        self.sums: Dict[str, float] = {}
+        self.recent: Dict[str, Deque[float]] = {}
+
+    @property
+    def jsonl_path(self) -> str:
+        return f'{self.path}.jsonl'
+
+    @property
+    def prom_path(self) -> str:
+        return f'{self.path}.prom'
+
+    def record(self, values: Dict[str, float]) -> None:
+        """
+        Appends the values of a turn to the log, and rewrites the summary.
+
+        :param values: The values of the turn, as returned by `Spans.finish`.
+        """
+        line = json.dumps({'time': round(time.time(), 3), **values}) + '\n'
+        if self.size + len(line) > self.max_size and os.path.isfile(self.jsonl_path):
+            os.replace(self.jsonl_path, f'{self.jsonl_path}.1')
+            self.size = 0
+        with open(self.jsonl_path, 'a') as jsonl_file:
+            jsonl_file.write(line)
+        self.size += len(line)
+        for name, value in values.items():
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.sums[name] = self.sums.get(name, 0) + value
+            self.recent.setdefault(name, deque(maxlen=self.window)).append(value)
+        self.write_summary()
+
+    def write_summary(self) -> None:
+        """
+        Writes the summary of every value, replacing the previous one only once it has been written completely.
+        """
+        lines = []
+        for name in sorted(self.counts):
+            metric = f'{self.prefix}_{name}'
+            recent = sorted(self.recent[name])
+            lines.append(f'# TYPE {metric} summary\n')
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'{metric}{{quantile="{q}"}} {recent[min(len(recent) - 1, int(q * len(recent)))]}\n')
+            lines.append(f'{metric}_sum {self.sums[name]}\n')
+            lines.append(f'{metric}_count {self.counts[name]}\n')
+        temp_path = f'{self.prom_path}.tmp'
+        with open(temp_path, 'w') as prom_file:
+            prom_file.writelines(lines)
+        os.replace(temp_path, self.prom_path)
@@ -0,0 +1,84 @@
+from typing import *
+from types import ModuleType
+import importlib
+import os
+import threading
+import time
+
+
+class ModuleRegistry(object):
+    """
+    Loads user modules ("domain:module", found at "modules/{domain}/{module}.py" on the python path) the first
+    time they are needed rather than all at once, and keeps them loaded. A loaded module is reloaded in place when
+    its file changes, so filters can be edited while playing.
+
+    The time taken to import each module is recorded in `import_times`.
+    """
+    def __init__(self, package: str = 'modules'):
+        """
+        :param package: The package the module domains are in.
+        """
+        self.package: str = package
+        self.modules: Dict[str, ModuleType] = {}
+        # The size and modification time of each loaded module's file, when it was last loaded
+        self.stats: Dict[str, Tuple[int, float]] = {}
+        # The time taken to import each module in milliseconds, the last time it was loaded
+        self.import_times: Dict[str, float] = {}
+        # Incremented every time a module is reloaded, so that anything resolved from the modules can be refreshed
+        self.version: int = 0
+        self.lock = threading.RLock()
+
+    def get(self, key: str) -> ModuleType:
+        """
+        :param key: The module, as "domain:module".
+        :return: The module, imported first if it hasn't been loaded yet.
+        """
+        with self.lock:
+            module = self.modules.get(key)
+            if module is None:
+                domain, name = key.split(':')
+                start = time.perf_counter()
+                module = importlib.import_module(f'.{name}', f'{self.package}.{domain}')
+                self.import_times[key] = (time.perf_counter() - start) * 1000.0
+                self.modules[key] = module
+                self.stats[key] = self.get_stat(module)
+            return module
+
+    def reload_changed(self) -> Dict[str, Optional[BaseException]]:
+        """
+        Reloads every loaded module whose file has changed since it was loaded. A module which fails to reload
+        stays as it was, and is only tried again once its file changes again.
+
+        :return: The modules which changed, each with the error raised while reloading it, or `None` if it was
+        reloaded.
+        """
+        changed = {}
+        with self.lock:
+            for key, module in self.modules.items():
+                stat = self.get_stat(module)
+                if stat == self.stats[key]:
+                    continue
+                self.stats[key] = stat
+                start = time.perf_counter()
+                try:
+                    importlib.reload(module)
+                except Exception as e:
+                    changed[key] = e
+                    continue
+                self.import_times[key] = (time.perf_counter() - start) * 1000.0
+                changed[key] = None
+            if any(e is None for e in changed.values()):
+                self.version += 1
+        return changed
+
+    @staticmethod
+    def get_stat(module: ModuleType) -> Tuple[int, float]:
+        """
+        :param module: A loaded module.
+        :return: The size and modification time of the module's file, or zeros if it has none.
+        """
+        path = getattr(module, '__file__', None)
+        if not path or not os.path.isfile(path):
+            return 0, 0.0
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime
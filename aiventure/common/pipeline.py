@@ -0,0 +1,88 @@
+from typing import *
+from types import ModuleType
+import time
+
+# A stage of a filter pipeline, either a filter function or a `str.translate` table
+Stage = Union[Callable[[str], str], Dict[int, Any]]
+
+
+def fuse_translations(first: Dict[int, Any], second: Dict[int, Any]) -> Dict[int, Any]:
+    """
+    Combines two `str.translate` tables into one, which translates text the same way as both in turn.
+
+    :param first: The table applied first.
+    :param second: The table applied second.
+    :return: The combined table.
+    """
+    fused = {}
+    for k, v in first.items():
+        if v is None:
+            fused[k] = None
+        else:
+            fused[k] = (chr(v) if isinstance(v, int) else v).translate(second)
+    for k, v in second.items():
+        fused.setdefault(k, v)
+    return fused
+
+
+class FilterPipeline(object):
+    """
+    Runs text through the filters of several modules in turn. Modules can split their filter into stages, so that
+    the translation tables of neighbouring stages are fused into a single `str.translate` pass.
+    The time spent in each stage is recorded, to find the filters which slow down every turn.
+    """
+    def __init__(self):
+        self.stages: List[Tuple[str, Stage]] = []
+        # The number of calls and the total time in seconds of each stage
+        self.times: Dict[str, List[float]] = {}
+
+    def add(self, name: str, stage: Stage) -> None:
+        """
+        Adds a stage to the end of the pipeline, fusing it with the previous stage if both are translation tables.
+
+        :param name: The name of the stage, used in its timing.
+        :param stage: A filter function, or a `str.translate` table.
+        """
+        if isinstance(stage, dict) and self.stages and isinstance(self.stages[-1][1], dict):
+            previous_name, previous = self.stages.pop()
+            name, stage = f'{previous_name}+{name}', fuse_translations(previous, stage)
+        self.stages.append((name, stage))
+        self.times.setdefault(name, [0, 0.0])
+
+    def add_filter(self, name: str, module: ModuleType, function: str) -> None:
+        """
+        Adds a module's filter to the end of the pipeline. If the module defines the filter's stages, as a list
+        named "{function}_stages", they are added instead of the filter itself.
+
+        :param name: The name of the filter, used in its timing.
+        :param module: The module to add the filter of.
+        :param function: The name of the filter function.
+        """
+        stages = getattr(module, f'{function}_stages', None)
+        if stages is None:
+            self.add(name, getattr(module, function))
+            return
+        for i, stage in enumerate(stages):
+            self.add(f'{name}[{i}]', stage)
+
+    def __call__(self, text: str) -> str:
+        """
+        :param text: The text to filter.
+        :return: The filtered text.
+        """
+        for name, stage in self.stages:
+            start = time.perf_counter()
+            text = text.translate(stage) if isinstance(stage, dict) else stage(text)
+            times = self.times[name]
+            times[0] += 1
+            times[1] += time.perf_counter() - start
+        return text
+
+    @property
+    def stats(self) -> List[Tuple[str, int, float]]:
+        """
+        :return: The name, number of calls and mean time in milliseconds of each stage, slowest first.
+        """
+        stats = [(name, int(calls), 1000.0 * total / calls if calls else 0.0)
+                 for name, (calls, total) in self.times.items()]
+        return sorted(stats, key=lambda s: s[2], reverse=True)
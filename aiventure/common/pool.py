@@ -0,0 +1,81 @@
+from typing import *
+from collections import OrderedDict
+import threading
+
+
+class ModelPool(object):
+    """
+    Keeps several loaded AI models in memory, keyed by their model path, within a memory budget.
+    When loading a model would go over the budget, the least recently used models are evicted first.
+    """
+    def __init__(self, budget: int = 0):
+        """
+        :param budget: The memory budget in bytes. 0 or less only keeps the most recently used model.
+        """
+        self.budget: int = budget
+        self.models: OrderedDict = OrderedDict()
+        self.lock = threading.RLock()
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        """
+        :return: The resident size of each loaded model in bytes, from least to most recently used.
+        """
+        return {k: m.resident_size for k, m in self.models.items()}
+
+    @property
+    def total_size(self) -> int:
+        """
+        :return: The total resident size of all the loaded models in bytes.
+        """
+        return sum(self.sizes.values())
+
+    def get(
+            self,
+            key: str,
+            load: Callable[[], Any],
+            size_hint: int = 0,
+            valid: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Retrieves a model from the pool, loading it if it isn't loaded already.
+
+        :param key: The key of the model, usually its path.
+        :param load: Loads the model, if it isn't in the pool.
+        :param size_hint: The estimated size of the model in bytes, used to evict other models before loading it,
+        so the budget isn't exceeded while it loads.
+        :param valid: If given, a loaded model it returns `False` for is loaded again.
+        :return: The model.
+        """
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None and (valid is None or valid(model)):
+                self.models.move_to_end(key)
+                return model
+            self.evict(key)
+            self.evict_to_fit(size_hint)
+            model = load()
+            self.models[key] = model
+            self.evict_to_fit(0)
+            return model
+
+    def evict(self, key: str) -> None:
+        """
+        Removes a model from the pool, if it is in it.
+
+        :param key: The key of the model.
+        """
+        with self.lock:
+            self.models.pop(key, None)
+
+    def evict_to_fit(self, size: int) -> None:
+        """
+        Evicts the least recently used models until a model of the given size fits in the budget.
+        The most recently used model is only evicted to make room for a new one.
+
+        :param size: The size in bytes to make room for.
+        """
+        with self.lock:
+            keep = 0 if size > 0 else 1
+            while len(self.models) > keep and (self.budget <= 0 or self.total_size + size > self.budget):
+                self.models.popitem(last=False)
@@ -0,0 +1,122 @@
+from typing import *
+import json
+import os
+
+from aiventure.common.backend import Backend
+
+
+class Prompt(object):
+    """
+    A scenario template, which a new adventure can be started from.
+    """
+    def __init__(self, name: str = '', context: str = '', prompt: str = ''):
+        """
+        :param name: The name of the template, also used as the name of adventures started from it.
+        :param context: The permanent story context.
+        :param prompt: The first action, which starts the story.
+        """
+        self.name: str = name
+        self.context: str = context
+        self.prompt: str = prompt
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'context': self.context,
+            'prompt': self.prompt,
+        }
+
+    def from_dict(self, d: Dict[str, Any]):
+        self.name = d['name']
+        self.context = d['context']
+        self.prompt = d.get('prompt', '')
+
+
+class PromptLibrary(object):
+    """
+    The scenario templates in a directory ("{directory}/{file}.json", each a prompt's `to_dict`), along with
+    snapshots of the key/value states of each template's context, so that starting an adventure from a template
+    doesn't have to prefill its context.
+
+    Key/value states are only valid for the model and precision which computed them, so each model and precision
+    has its own snapshots ("{directory}/.snapshots/{model}-{precision}/{file}.pt"). A snapshot also records the
+    files of the model it was computed with, so it is computed again when the model is replaced.
+    """
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory the templates are in.
+        """
+        self.directory: str = directory
+        # The templates, keyed by their file name without an extension
+        self.prompts: Dict[str, Prompt] = {}
+
+    def load(self) -> Dict[str, Exception]:
+        """
+        Loads every template in the directory, replacing the ones loaded before.
+
+        :return: The templates which couldn't be loaded, each with the error raised while loading it.
+        """
+        prompts, errors = {}, {}
+        files = sorted(f for f in os.listdir(self.directory) if f.endswith('.json')) \
+            if os.path.isdir(self.directory) else []
+        for f in files:
+            file = f[:-len('.json')]
+            try:
+                with open(os.path.join(self.directory, f), 'r') as json_file:
+                    prompt = Prompt()
+                    prompt.from_dict(json.load(json_file))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                errors[file] = e
+                continue
+            prompts[file] = prompt
+        self.prompts = prompts
+        return errors
+
+    def find(self, context: str) -> Optional[str]:
+        """
+        :param context: The context of an adventure.
+        :return: The file of the template with the same context, or `None` if there is none.
+        """
+        return next((file for file, prompt in self.prompts.items() if prompt.context == context), None)
+
+    def get_snapshot_path(self, file: str, model: str, precision: str) -> str:
+        """
+        :param file: The template's file name, without an extension.
+        :param model: The name of the model.
+        :param precision: The precision the model is running in.
+        :return: The path of the snapshot of the template's context.
+        """
+        return os.path.join(self.directory, '.snapshots', f'{model}-{precision}', f'{file}.pt')
+
+    def prepare(self, backend: Backend, model: str) -> List[str]:
+        """
+        Saves a snapshot of every template's context which doesn't have an up to date one yet. This prefills every
+        such context, so it is meant to be run in its own thread.
+
+        :param backend: The model to prefill the contexts with.
+        :param model: The name of the model.
+        :return: The templates whose snapshots were saved.
+        """
+        saved = []
+        for file, prompt in list(self.prompts.items()):
+            path = self.get_snapshot_path(file, model, backend.precision)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if backend.save_prefix(backend.encode(prompt.context), path):
+                saved.append(file)
+        return saved
+
+    def prime(self, backend: Backend, model: str, context: str) -> bool:
+        """
+        Loads the snapshot of the template with the given context, so that the first generation of an adventure
+        started from it doesn't prefill the context.
+
+        :param backend: The model which will generate for the adventure.
+        :param model: The name of the model.
+        :param context: The adventure's context.
+        :return: `True` if a snapshot was loaded, `False` if no template has the context or its snapshot is missing
+        or out of date.
+        """
+        file = self.find(context)
+        if file is None:
+            return False
+        return backend.load_prefix(backend.encode(context), self.get_snapshot_path(file, model, backend.precision))
@@ -0,0 +1,188 @@
+from typing import *
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlparse
+import json
+import queue
+
+from aiventure.common.backend import Backend, CancelToken
+from aiventure.common.metrics import Spans
+from aiventure.common.stopping import StoppingCriterion, criterion_types
+from aiventure.common.vocabulary import Vocabulary
+
+
+class RemoteBackend(Backend):
+    """
+    Generates text using a model served by an aiventure server, so the client doesn't need to run a model itself.
+    Connections to the server are kept alive and reused between requests.
+    """
+    def __init__(self, url: str, pool_size: int = 4, timeout: Optional[float] = None):
+        """
+        :param url: The URL of the server, eg. "http://localhost:8000".
+        :param pool_size: The maximum number of idle connections kept open.
+        :param timeout: The socket timeout of each connection, in seconds. `None` waits indefinitely.
+        """
+        parsed = urlparse(url if '://' in url else f'http://{url}')
+        self.url: str = url
+        self.host: str = parsed.hostname
+        self.port: int = parsed.port or 80
+        self.timeout: Optional[float] = timeout
+        self.connections: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self.info: Dict[str, Any] = self._request('GET', '/info')
+        self.precision = self.info['precision']
+
+    @property
+    def model_info(self) -> str:
+        return f'{self.info["model_info"]} at {self.url}'
+
+    @property
+    def resident_size(self) -> int:
+        return 0
+
+    @property
+    def max_positions(self) -> int:
+        return self.info['max_positions']
+
+    def encode(self, text: str) -> List[int]:
+        return self._request('POST', '/encode', {'text': text})['tokens']
+
+    def generate_candidates(
+            self,
+            text: Union[str, List[int]],
+            num_candidates: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[StoppingCriterion]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> List[str]:
+        """
+        Generates several alternative raw, unaltered strings on the server. See `Backend.generate_candidates`.
+        Cancelling the token closes the connection, which stops the server generating too. The server enforces the
+        token's deadline, and its partial results are returned when it passes. The spans get the server's
+        measurements. Only the stopping criteria in `criterion_types` can be sent to the server, so others are left
+        out.
+        """
+        remaining = cancel_token.remaining if cancel_token else None
+        body = {
+            'text': text,
+            'num_candidates': num_candidates,
+            'max_length': max_length,
+            'beam_searches': beam_searches,
+            'temperature': temperature,
+            'top_k': top_k,
+            'top_p': top_p,
+            'repetition_penalty': repetition_penalty,
+            # a deadline which has already passed must not turn into no deadline at all
+            'timeout': None if remaining is None else max(remaining, 1e-6),
+            'stopping_criteria': [c.to_dict() for c in stopping_criteria or [] if c.type in criterion_types],
+            'vocabulary': vocabulary.to_dict() if vocabulary else None,
+            'use_cache': use_cache,
+        }
+        connection, response = self._send('POST', '/generate', body)
+        chunks = []
+        try:
+            for line in response:
+                if cancel_token and cancel_token.cancelled:
+                    # the server notices the closed connection and stops generating
+                    connection.close()
+                    return [''.join(chunks)]
+                data = json.loads(line)
+                if 'error' in data:
+                    raise RuntimeError(data['error'])
+                if 'chunk' in data:
+                    chunks.append(data['chunk'])
+                    if callback:
+                        callback(data['chunk'])
+                if 'results' in data:
+                    if cancel_token and data['timed_out']:
+                        cancel_token.timed_out = True
+                    if spans is not None:
+                        for name, value in data.get('stats', {}).items():
+                            spans.add(name, value)
+                    response.read()
+                    self._release(connection)
+                    return data['results']
+        except BaseException:
+            connection.close()
+            raise
+        connection.close()
+        raise ConnectionError(f'The server at {self.url} ended the generation without any results.')
+
+    def close(self) -> None:
+        """
+        Closes all of the idle connections to the server.
+        """
+        while not self.connections.empty():
+            self.connections.get_nowait().close()
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Sends a request to the server and waits for the complete JSON response.
+
+        :param method: The HTTP method.
+        :param path: The path of the request.
+        :param body: The JSON body of the request, if any.
+        :return: The decoded JSON response.
+        """
+        connection, response = self._send(method, path, body)
+        try:
+            data = json.loads(response.read())
+        except BaseException:
+            connection.close()
+            raise
+        self._release(connection)
+        if response.status != 200:
+            raise RuntimeError(data.get('error', f'The server responded with status {response.status}.'))
+        return data
+
+    def _send(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[HTTPConnection, Any]:
+        """
+        Sends a request to the server on a pooled connection, retrying once on a fresh connection if the pooled
+        one was closed by the server while it was idle.
+
+        :param method: The HTTP method.
+        :param path: The path of the request.
+        :param body: The JSON body of the request, if any.
+        :return: The connection used, and the response, whose body hasn't been read yet.
+        """
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        for attempt in range(2):
+            connection = self._acquire(fresh=attempt > 0)
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                return connection, connection.getresponse()
+            except (HTTPException, ConnectionError):
+                connection.close()
+                if attempt > 0:
+                    raise
+
+    def _acquire(self, fresh: bool = False) -> HTTPConnection:
+        """
+        :param fresh: If `True`, always opens a new connection.
+        :return: An idle connection from the pool, or a new one if there are none.
+        """
+        if not fresh:
+            try:
+                return self.connections.get_nowait()
+            except queue.Empty:
+                pass
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection: HTTPConnection) -> None:
+        """
+        Returns a connection to the pool once its response has been read completely.
+
+        :param connection: The connection to return.
+        """
+        try:
+            self.connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
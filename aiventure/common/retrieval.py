@@ -0,0 +1,214 @@
+from typing import *
+import json
+import math
+import os
+import re
+import zlib
+
+term_pattern = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Words too common to tell passages apart
+stop_words = frozenset(
+    'a an and are as at be but by for from had has have he her him his i in is it its me my of on or she so that '
+    'the their them then there they this to was we were what when which who will with you your'.split()
+)
+
+
+def get_terms(text: str) -> List[str]:
+    """
+    :param text: The text to split.
+    :return: The lowercase words of the text which are worth searching for, in order.
+    """
+    return [t for t in term_pattern.findall(text.lower()) if t not in stop_words]
+
+
+class PassageIndex(object):
+    """
+    An inverted index over the entries of a story, which ranks them by their BM25 relevance to a query, so that
+    entries far outside the AI's memory can be recalled when they matter again. Adding or removing an entry only
+    touches the terms of that entry.
+
+    A fingerprint of each entry's text is kept alongside it, so an index which was saved can be brought up to date
+    with the entries by `sync`, reindexing only the ones which changed since.
+    """
+    __slots__ = ('postings', 'lengths', 'fingerprints', 'total_length', 'k1', 'b')
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """
+        :param k1: How quickly repeating a term in an entry stops making it more relevant.
+        :param b: How much longer entries are penalized for containing more terms.
+        """
+        # The number of times each term occurs in each entry which contains it
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # The number of terms in each entry
+        self.lengths: List[int] = []
+        # The CRC-32 of each entry's text
+        self.fingerprints: List[int] = []
+        self.total_length: int = 0
+        self.k1: float = k1
+        self.b: float = b
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, text: str) -> None:
+        """
+        Adds an entry after the last indexed one.
+
+        :param text: The text of the entry.
+        """
+        index = len(self.lengths)
+        terms = get_terms(text)
+        for term in terms:
+            entries = self.postings.setdefault(term, {})
+            entries[index] = entries.get(index, 0) + 1
+        self.lengths.append(len(terms))
+        self.fingerprints.append(self.get_fingerprint(text))
+        self.total_length += len(terms)
+
+    def remove(self, text: str) -> None:
+        """
+        Removes the last indexed entry.
+
+        :param text: The text the entry was indexed with.
+        """
+        index = len(self.lengths) - 1
+        self._remove_terms(index, text)
+        self.total_length -= self.lengths.pop()
+        self.fingerprints.pop()
+
+    def replace(self, index: int, old_text: str, text: str) -> None:
+        """
+        Indexes an entry again after it has been edited.
+
+        :param index: The index of the entry.
+        :param old_text: The text the entry was indexed with.
+        :param text: The new text of the entry.
+        """
+        self._remove_terms(index, old_text)
+        terms = get_terms(text)
+        for term in terms:
+            entries = self.postings.setdefault(term, {})
+            entries[index] = entries.get(index, 0) + 1
+        self.total_length += len(terms) - self.lengths[index]
+        self.lengths[index] = len(terms)
+        self.fingerprints[index] = self.get_fingerprint(text)
+
+    def truncate(self, length: int) -> None:
+        """
+        Removes every entry after the first ones, without knowing the text they were indexed with. This goes through
+        every term in the index, so `remove` is faster when the text is known.
+
+        :param length: The number of entries to keep.
+        """
+        if length >= len(self.lengths):
+            return
+        for term in list(self.postings):
+            entries = self.postings[term]
+            for index in [i for i in entries if i >= length]:
+                del entries[index]
+            if not entries:
+                del self.postings[term]
+        del self.lengths[length:]
+        del self.fingerprints[length:]
+        self.total_length = sum(self.lengths)
+
+    def sync(self, texts: List[str]) -> None:
+        """
+        Brings the index up to date with the entries of a story. Every entry after the first one which doesn't
+        match its fingerprint is indexed again, so this is fast when entries were only added or removed at the end.
+
+        :param texts: The text of every entry.
+        """
+        common = min(len(texts), len(self.fingerprints))
+        length = next((i for i in range(common) if self.get_fingerprint(texts[i]) != self.fingerprints[i]), common)
+        self.truncate(length)
+        for text in texts[length:]:
+            self.add(text)
+
+    def search(self, query: str, k: int, end: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        :param query: The text to find relevant entries for.
+        :param k: The maximum number of entries to return.
+        :param end: If given, only entries before it are searched.
+        :return: The index and score of the most relevant entries, most relevant first. Entries sharing no terms
+        with the query are never returned.
+        """
+        end = len(self.lengths) if end is None else min(end, len(self.lengths))
+        if end <= 0 or k <= 0:
+            return []
+        mean_length = max(1.0, self.total_length / len(self.lengths))
+        scores: Dict[int, float] = {}
+        for term in set(get_terms(query)):
+            entries = self.postings.get(term)
+            if not entries:
+                continue
+            idf = math.log(1.0 + (len(self.lengths) - len(entries) + 0.5) / (len(entries) + 0.5))
+            for index, count in entries.items():
+                if index >= end:
+                    continue
+                norm = self.k1 * (1.0 - self.b + self.b * self.lengths[index] / mean_length)
+                scores[index] = scores.get(index, 0.0) + idf * count * (self.k1 + 1.0) / (count + norm)
+        return sorted(scores.items(), key=lambda s: (-s[1], -s[0]))[:k]
+
+    def to_dict(self) -> dict:
+        return {
+            # flattened into [entry, count, entry, count, ...], since JSON keys can only be strings
+            'postings': {t: [n for e in entries.items() for n in e] for t, entries in self.postings.items()},
+            'lengths': self.lengths,
+            'fingerprints': self.fingerprints,
+        }
+
+    def from_dict(self, d: Dict[str, Any]):
+        self.postings = {t: dict(zip(flat[0::2], flat[1::2])) for t, flat in d['postings'].items()}
+        self.lengths = list(d['lengths'])
+        self.fingerprints = list(d['fingerprints'])
+        self.total_length = sum(self.lengths)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the index to a file, through a temporary file so a previously saved index stays intact if writing is
+        interrupted.
+
+        :param path: The path of the file.
+        """
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as json_file:
+            json.dump(self.to_dict(), json_file)
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        :param path: The path of a file written by `save`.
+        :return: `True` if the index was loaded, `False` if the file is missing or unreadable, in which case the
+        index is left unchanged.
+        """
+        try:
+            with open(path, 'r') as json_file:
+                data = json.load(json_file)
+            index = PassageIndex(self.k1, self.b)
+            index.from_dict(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.postings, self.lengths, self.fingerprints = index.postings, index.lengths, index.fingerprints
+        self.total_length = index.total_length
+        return True
+
+    @staticmethod
+    def get_fingerprint(text: str) -> int:
+        """
+        :param text: The text of an entry.
+        :return: The CRC-32 of the text.
+        """
+        return zlib.crc32(text.encode('utf-8'))
+
+    def _remove_terms(self, index: int, text: str) -> None:
+        """
+        :param index: The index of an entry.
+        :param text: The text the entry was indexed with.
+        """
+        for term in set(get_terms(text)):
+            entries = self.postings.get(term)
+            if entries is not None:
+                entries.pop(index, None)
+                if not entries:
+                    del self.postings[term]
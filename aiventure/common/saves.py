@@ -0,0 +1,139 @@
+from typing import *
+import json
+import os
+import threading
+
+from aiventure.common.adventure import Adventure
+from aiventure.common.journal import Journal
+
+
+class SaveIndex(object):
+    """
+    Keeps the metadata of every save in a directory in a single index file, so that listing the saves doesn't
+    require loading them. The index is updated whenever an adventure is saved, and an entry is only rebuilt, by
+    loading its save, when the save's size or modification time no longer matches the one recorded.
+
+    Each entry holds the adventure's name, the save's file name without an extension, its size in bytes, its number
+    of turns, and the time it was last modified.
+    """
+    def __init__(self, directory: str, filename: str = 'saves.index'):
+        """
+        :param directory: The directory the saves are in.
+        :param filename: The file name of the index inside the directory.
+        """
+        self.directory: str = directory
+        self.path: str = os.path.join(directory, filename)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.loaded: bool = False
+        self.lock = threading.RLock()
+
+    def get_entries(self) -> List[Dict[str, Any]]:
+        """
+        :return: The entries in the index, most recently modified first, without checking them against the saves.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.read()
+            return sorted(self.entries.values(), key=lambda e: e['mtime'], reverse=True)
+
+    def get_stat(self, file: str) -> Tuple[int, float]:
+        """
+        :param file: The save's file name, without an extension.
+        :return: The total size of the save's snapshot and journal in bytes, and the time either was last modified.
+        """
+        journal = Journal(os.path.join(self.directory, file))
+        size, mtime = 0, 0.0
+        for path in (journal.snapshot_path, journal.journal_path):
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+        return size, mtime
+
+    def update(self, file: str, adventure: Adventure) -> None:
+        """
+        Updates the entry of a save after it has been written.
+
+        :param file: The save's file name, without an extension.
+        :param adventure: The adventure which was saved.
+        """
+        size, mtime = self.get_stat(file)
+        with self.lock:
+            if not self.loaded:
+                self.read()
+            self.entries[file] = {
+                'name': adventure.name,
+                'file': file,
+                'size': size,
+                'turns': len(adventure.actions),
+                'mtime': mtime,
+            }
+            self.write()
+
+    def scan(self) -> List[Dict[str, Any]]:
+        """
+        Brings the index up to date with the saves in the directory, loading only the saves which have changed
+        since they were indexed. This can take a while if the index is missing, so it is meant to be run in its
+        own thread.
+
+        :return: The entries in the index, most recently modified first.
+        """
+        files = [e.name[:-len('.json')] for e in os.scandir(self.directory) if e.name.endswith('.json')]
+        with self.lock:
+            if not self.loaded:
+                self.read()
+            original = dict(self.entries)
+        entries = dict(original)
+        changed = set(entries) != set(files)
+        for file in files:
+            size, mtime = self.get_stat(file)
+            entry = entries.get(file)
+            if entry is not None and entry['size'] == size and entry['mtime'] == mtime:
+                continue
+            adventure = Adventure()
+            try:
+                Journal(os.path.join(self.directory, file)).load(adventure)
+            except (OSError, ValueError, KeyError):
+                # not a valid save
+                entries.pop(file, None)
+                continue
+            entries[file] = {
+                'name': adventure.name,
+                'file': file,
+                'size': size,
+                'turns': len(adventure.actions),
+                'mtime': mtime,
+            }
+            changed = True
+        with self.lock:
+            scanned = {f: entries[f] for f in files if f in entries}
+            # entries updated by saves made during the scan are newer than the scanned ones
+            for file, entry in self.entries.items():
+                if entry is not original.get(file):
+                    scanned[file] = entry
+            self.entries = scanned
+            if changed:
+                self.write()
+        return self.get_entries()
+
+    def read(self) -> None:
+        """
+        Reads the index file, starting with an empty index if it is missing or unreadable.
+        """
+        with self.lock:
+            try:
+                with open(self.path, 'r') as index_file:
+                    self.entries = json.load(index_file)
+            except (OSError, ValueError):
+                self.entries = {}
+            self.loaded = True
+
+    def write(self) -> None:
+        """
+        Writes the index file, replacing the previous one only once it has been written completely.
+        """
+        with self.lock:
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w') as index_file:
+                json.dump(self.entries, index_file)
+            os.replace(temp_path, self.path)
@@ -0,0 +1,226 @@
+from typing import *
+from collections import deque
+import threading
+import time
+
+from aiventure.common.backend import Backend, CancelToken
+from aiventure.common.metrics import Spans
+from aiventure.common.stopping import StoppingCriterion
+from aiventure.common.vocabulary import Vocabulary
+
+if TYPE_CHECKING:
+    from aiventure.common.ai import AI
+
+
+class ScheduledRequest(object):
+    """
+    A generation request waiting in, or being processed by, a scheduler.
+    """
+    def __init__(self, kwargs: Dict[str, Any]):
+        """
+        :param kwargs: The keyword arguments of `Backend.generate_candidates`.
+        """
+        self.kwargs: Dict[str, Any] = kwargs
+        self.submitted: float = time.monotonic()
+        self.done = threading.Event()
+        self.results: List[str] = []
+        self.error: Optional[BaseException] = None
+
+    @property
+    def rows(self) -> int:
+        """
+        :return: The number of sequences the request takes up in a batch.
+        """
+        return max(1, self.kwargs['num_candidates'])
+
+    @property
+    def batchable(self) -> bool:
+        """
+        :return: Whether the request can be generated together with others. Beam searches run on their own.
+        """
+        return self.kwargs['beam_searches'] <= 1
+
+
+class Scheduler(Backend):
+    """
+    Lets several sessions share one model. Requests from all sessions are queued, and the ones arriving within a
+    short window of each other are generated together as one padded batch, each with its own sampling parameters.
+    Queue wait, batch size and throughput are tracked in `stats`.
+    """
+    def __init__(self, ai: 'AI', max_batch_size: int = 8, batch_window: float = 0.02):
+        """
+        :param ai: The model to generate with.
+        :param max_batch_size: The maximum number of sequences generated in one batch.
+        :param batch_window: How long to wait for more requests after the first one arrives, in seconds.
+        """
+        self.ai: 'AI' = ai
+        self.precision = ai.precision
+        self.max_batch_size: int = max_batch_size
+        self.batch_window: float = batch_window
+        self.queue: Deque[ScheduledRequest] = deque()
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        # Statistics
+        self.num_requests: int = 0
+        self.num_batches: int = 0
+        self.num_rows: int = 0
+        self.num_tokens: int = 0
+        self.queue_wait: float = 0.0
+        self.max_queue_wait: float = 0.0
+        self.busy_time: float = 0.0
+
+    @property
+    def model_info(self) -> str:
+        return self.ai.model_info
+
+    @property
+    def resident_size(self) -> int:
+        return self.ai.resident_size
+
+    @property
+    def max_positions(self) -> int:
+        return self.ai.max_positions
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: The number of requests and batches processed, the mean and maximum time requests waited in the
+        queue in milliseconds, the mean number of sequences per batch, the number of requests still queued, and the
+        number of tokens generated per second while generating.
+        """
+        with self.condition:
+            return {
+                'requests': self.num_requests,
+                'batches': self.num_batches,
+                'queued': len(self.queue),
+                'mean_queue_wait_ms': 1000.0 * self.queue_wait / max(1, self.num_requests),
+                'max_queue_wait_ms': 1000.0 * self.max_queue_wait,
+                'mean_batch_size': self.num_rows / max(1, self.num_batches),
+                'tokens_per_sec': self.num_tokens / self.busy_time if self.busy_time > 0 else 0.0,
+            }
+
+    def encode(self, text: str) -> List[int]:
+        return self.ai.encode(text)
+
+    def save_prefix(self, token_ids: List[int], path: str) -> bool:
+        return self.ai.save_prefix(token_ids, path)
+
+    def load_prefix(self, token_ids: List[int], path: str) -> bool:
+        return self.ai.load_prefix(token_ids, path)
+
+    def generate_candidates(
+            self,
+            text: Union[str, List[int]],
+            num_candidates: int,
+            max_length: int,
+            beam_searches: int,
+            temperature: float,
+            top_k: float,
+            top_p: float,
+            repetition_penalty: float,
+            callback: Optional[Callable[[str], None]] = None,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[StoppingCriterion]] = None,
+            vocabulary: Optional[Vocabulary] = None,
+            spans: Optional[Spans] = None,
+            use_cache: bool = True,
+    ) -> List[str]:
+        """
+        Queues a request and waits for it to be generated. See `Backend.generate_candidates`.
+        The callback is called from the scheduler's thread. The time spent waiting in the queue is added to the
+        spans as "queue_ms". The scheduler's own statistics are also taken from the spans, so every request gets
+        them.
+        """
+        request = ScheduledRequest({
+            'text': text,
+            'num_candidates': num_candidates,
+            'max_length': max_length,
+            'beam_searches': beam_searches,
+            'temperature': temperature,
+            'top_k': top_k,
+            'top_p': top_p,
+            'repetition_penalty': repetition_penalty,
+            'callback': callback,
+            'cancel_token': cancel_token,
+            'stopping_criteria': stopping_criteria,
+            'vocabulary': vocabulary,
+            'spans': spans if spans is not None else Spans(),
+            'use_cache': use_cache,
+        })
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                self.thread.start()
+            self.queue.append(request)
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self) -> List[ScheduledRequest]:
+        """
+        Waits for requests, then keeps collecting them until the batch window closes or the batch is full.
+        Requests cancelled while they were queued are finished right away.
+
+        :return: The requests to generate together.
+        """
+        batch = []
+        with self.condition:
+            deadline = 0.0
+            while True:
+                while self.queue:
+                    request = self.queue[0]
+                    token = request.kwargs['cancel_token']
+                    if token and token.check():
+                        self.queue.popleft()
+                        request.results = ['']
+                        request.done.set()
+                        continue
+                    if batch and (not request.batchable or not batch[0].batchable
+                                  or sum(r.rows for r in batch) + request.rows > self.max_batch_size):
+                        return batch
+                    if not batch:
+                        deadline = request.submitted + self.batch_window
+                    batch.append(self.queue.popleft())
+                remaining = deadline - time.monotonic()
+                full = sum(r.rows for r in batch) >= self.max_batch_size
+                if batch and (remaining <= 0 or full or not batch[0].batchable):
+                    return batch
+                self.condition.wait(remaining if batch else None)
+
+    def _run(self) -> None:
+        """
+        Generates batches of requests until the program exits.
+        """
+        while True:
+            batch = self._next_batch()
+            start = time.monotonic()
+            # the spans may already hold the counts of earlier generations
+            generated = [r.kwargs['spans'].values.get('tokens_generated', 0) for r in batch]
+            for request in batch:
+                request.kwargs['spans'].add('queue_ms', (start - request.submitted) * 1000.0)
+            try:
+                if len(batch) == 1:
+                    # a request on its own can reuse the key/value cache of the previous one
+                    batch[0].results = self.ai.generate_candidates(**batch[0].kwargs)
+                else:
+                    for request, results in zip(batch, self.ai.generate_batch([r.kwargs for r in batch])):
+                        request.results = results
+            except Exception as e:
+                # every request of the batch fails, and raises the error in its own session
+                for request in batch:
+                    request.error = e
+            end = time.monotonic()
+            num_tokens = sum(r.kwargs['spans'].values.get('tokens_generated', 0) for r in batch) - sum(generated)
+            with self.condition:
+                self.num_batches += 1
+                self.num_rows += sum(r.rows for r in batch)
+                self.num_tokens += num_tokens
+                self.busy_time += end - start
+                for request in batch:
+                    self.num_requests += 1
+                    self.queue_wait += start - request.submitted
+                    self.max_queue_wait = max(self.max_queue_wait, start - request.submitted)
+            for request in batch:
+                request.done.set()
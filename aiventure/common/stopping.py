@@ -0,0 +1,98 @@
+from typing import *
+
+
+class StoppingCriterion(object):
+    """
+    Decides whether a sequence can stop generating, from the tokens generated for it so far. Criteria are checked
+    after every decoding step, and shouldn't keep any state between calls, so one criterion can be shared by many
+    sequences and sessions at once.
+    """
+    # The name the criterion is registered under in `criterion_types`, so it can be sent to a server
+    type: str = ''
+
+    def __call__(self, output_ids: List[int], decode: Callable[[List[int]], str]) -> bool:
+        """
+        :param output_ids: The token ids generated so far, not including the input.
+        :param decode: Decodes token ids into text.
+        :return: `True` if generation should stop, `False` otherwise.
+        """
+        raise NotImplementedError()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: The criterion's type and parameters, which `from_dict` creates it again from.
+        """
+        return {'type': self.type, **vars(self)}
+
+
+class SentenceEndCriterion(StoppingCriterion):
+    """
+    Stops once a sentence is complete, after a minimum number of tokens. A sentence is complete when the last token
+    ends it and no quotation is left open, since the output filters remove everything after the last sentence end
+    anyway.
+    """
+    type = 'sentence_end'
+
+    def __init__(self, min_tokens: int = 30, ends: str = '.!?"“”'):
+        """
+        :param min_tokens: The number of tokens to generate before stopping at a sentence end.
+        :param ends: The characters which end a sentence, including closing quotation marks.
+        """
+        self.min_tokens: int = min_tokens
+        self.ends: str = ends
+
+    def __call__(self, output_ids: List[int], decode: Callable[[List[int]], str]) -> bool:
+        if len(output_ids) < self.min_tokens:
+            return False
+        last = decode(output_ids[-1:]).rstrip()
+        if not last or last[-1] not in self.ends:
+            return False
+        # only decode the whole output for the few tokens which might end a sentence
+        text = decode(output_ids)
+        return (text.count('"') + text.count('“') + text.count('”')) % 2 == 0
+
+
+class RepetitionCriterion(StoppingCriterion):
+    """
+    Stops once generation falls into a loop, repeating the same run of tokens over and over.
+    """
+    type = 'repetition'
+
+    def __init__(self, ngram_size: int = 6, max_repeats: int = 2):
+        """
+        :param ngram_size: The number of tokens in a repeated run.
+        :param max_repeats: The number of times the last run of tokens may already have been generated before.
+        """
+        self.ngram_size: int = ngram_size
+        self.max_repeats: int = max_repeats
+
+    def __call__(self, output_ids: List[int], decode: Callable[[List[int]], str]) -> bool:
+        n = self.ngram_size
+        if len(output_ids) < n * (self.max_repeats + 1):
+            return False
+        last = output_ids[-n:]
+        first = last[0]
+        repeats = 0
+        for i in range(len(output_ids) - n):
+            if output_ids[i] == first and output_ids[i:i + n] == last:
+                repeats += 1
+                if repeats >= self.max_repeats:
+                    return True
+        return False
+
+
+# The criteria which can be created from their `to_dict`
+criterion_types: Dict[str, Type[StoppingCriterion]] = {
+    SentenceEndCriterion.type: SentenceEndCriterion,
+    RepetitionCriterion.type: RepetitionCriterion,
+}
+
+
+def from_dict(data: Dict[str, Any]) -> StoppingCriterion:
+    """
+    :param data: The type and parameters of a criterion, as returned by its `to_dict`.
+    :return: The criterion.
+    :raises KeyError: If the criterion's type isn't in `criterion_types`.
+    """
+    data = dict(data)
+    return criterion_types[data.pop('type')](**data)
@@ -0,0 +1,90 @@
+from typing import *
+
+from aiventure.common.adventure import Adventure
+from aiventure.common.backend import Backend, CancelToken
+from aiventure.common.stopping import StoppingCriterion
+
+
+class Summarizer(object):
+    """
+    Condenses the entries of a story which have fallen out of the AI's memory into a rolling summary, so the AI
+    still knows what happened in them while its prompt stays the same size however long the story grows.
+
+    Each summary is generated from the previous one followed by the entries since, and asked for with a trailing
+    "TL;DR:", which gpt-2 learned to follow with a summary. Entries are summarized several at a time, so the model
+    isn't kept busy after every turn.
+    """
+    def __init__(
+            self,
+            max_length: int = 80,
+            min_entries: int = 8,
+            max_entries: int = 16,
+            prompt: str = '\nTL;DR:',
+            temperature: float = 0.7,
+            top_k: float = 40,
+            top_p: float = 0.9,
+            repetition_penalty: float = 1.2,
+    ):
+        """
+        :param max_length: The maximum number of tokens in a summary.
+        :param min_entries: The number of entries which must have fallen out of the AI's memory before they are
+        summarized.
+        :param max_entries: The maximum number of entries added to the summary at once, so that the previous summary
+        always fits in the prompt along with them.
+        :param prompt: The text after the entries which asks for a summary.
+        :param temperature: The temperature used to sample summaries, lower than the story's so they stick to it.
+        :param top_k: The top_k value used to sample summaries.
+        :param top_p: The top_p value used to sample summaries.
+        :param repetition_penalty: The repetition penalty of summaries, which otherwise tend to repeat themselves.
+        """
+        self.max_length: int = max_length
+        self.min_entries: int = min_entries
+        self.max_entries: int = max_entries
+        self.prompt: str = prompt
+        self.temperature: float = temperature
+        self.top_k: float = top_k
+        self.top_p: float = top_p
+        self.repetition_penalty: float = repetition_penalty
+
+    def get_pending(self, adventure: Adventure, window_start: int) -> Optional[Tuple[int, int]]:
+        """
+        :param adventure: The adventure to summarize.
+        :param window_start: The first entry the AI still remembers.
+        :return: The first and last entry to summarize next, or `None` if there aren't enough entries to summarize.
+        """
+        start = adventure.summary_end
+        if window_start - start < self.min_entries:
+            return None
+        # summaries end after a result, so they are always followed by an action
+        end = min(window_start, start + self.max_entries)
+        end -= end % 2
+        return (start, end) if end - start >= 2 else None
+
+    def summarize(
+            self,
+            backend: Backend,
+            adventure: Adventure,
+            start: int,
+            end: int,
+            cancel_token: Optional[CancelToken] = None,
+            stopping_criteria: Optional[List[StoppingCriterion]] = None,
+    ) -> str:
+        """
+        Generates a new summary of the story up to an entry. The adventure isn't changed, and neither is the
+        key/value cache the backend keeps of the story's prompt.
+
+        :param backend: The AI to generate the summary with.
+        :param adventure: The adventure to summarize.
+        :param start: The first entry which isn't in the adventure's summary yet.
+        :param end: The entry to summarize the story up to.
+        :param cancel_token: If given, used to stop the generation early.
+        :param stopping_criteria: Criteria checked after every decoding step which can end the summary early.
+        :return: The unaltered text generated for the new summary.
+        """
+        text = ' '.join([adventure.summary] + adventure.entries[start:end]).strip() + self.prompt
+        return backend.generate(
+            text, self.max_length, 1, self.temperature, self.top_k, self.top_p, self.repetition_penalty,
+            cancel_token=cancel_token,
+            stopping_criteria=stopping_criteria,
+            use_cache=False,
+        )
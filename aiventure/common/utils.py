@@ -1,10 +1,13 @@
+from typing import *
 import re
 import os
+import subprocess
+import sys
 
 
-class StopThreadException(BaseException):
+class GenerationCancelledException(Exception):
     """
-    Dummy exception for stopping threads using the func_timeout StoppableThread.
+    Raised when the user cancels an AI generation before it completes.
     """
     pass
 
@@ -28,4 +31,50 @@ def is_model_valid(model_path: str) -> bool:
     """
     return os.path.isfile(os.path.join(model_path, 'pytorch_model.bin')) \
         and os.path.isfile(os.path.join(model_path, 'config.json')) \
-        and os.path.isfile(os.path.join(model_path, 'vocab.json'))
\ No newline at end of file
+        and os.path.isfile(os.path.join(model_path, 'vocab.json'))
+
+
+def get_model_file_size(model_path: str) -> int:
+    """
+    :param model_path: The path of the pytorch model.
+    :return: The size of the model's weights file in bytes, or 0 if it doesn't exist.
+    """
+    weights_path = os.path.join(model_path, 'pytorch_model.bin')
+    return os.path.getsize(weights_path) if os.path.isfile(weights_path) else 0
+
+
+def get_model_fingerprint(model_path: str) -> str:
+    """
+    :param model_path: The path of the pytorch model.
+    :return: The size and modification time of each of the model's files, which changes whenever the model is
+    replaced.
+    """
+    parts = []
+    for name in ('config.json', 'pytorch_model.bin', 'vocab.json', 'merges.txt'):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append(f'{name}:{stat.st_size}:{stat.st_mtime_ns}')
+    return ','.join(parts)
+
+
+def get_import_times(module: str) -> List[Tuple[str, float, float]]:
+    """
+    Imports a module in a fresh python interpreter, measuring how long it and every module it imports takes to
+    import, the same way `python -X importtime` does.
+
+    :param module: The name of the module to import.
+    :return: A list of the imported modules' names, their own import times and their cumulative import times
+    (including the modules they import) in milliseconds, in the order they finished importing.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+    )
+    result = []
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)', line)
+        if match:
+            result.append((match.group(4), int(match.group(1)) / 1000.0, int(match.group(2)) / 1000.0))
+    return result
@@ -0,0 +1,57 @@
+from typing import *
+
+
+class Vocabulary(object):
+    """
+    The words and phrases whose likelihood is changed while generating, declared by modules. A bias is added to the
+    AI's logits for a word, making it more likely if positive and less likely if negative, and a banned word or
+    phrase can't be generated at all.
+
+    Each word is matched with and without a leading space, and capitalized, since those are different tokens.
+    """
+    def __init__(self, biases: Optional[Dict[str, float]] = None, bans: Optional[List[str]] = None):
+        """
+        :param biases: The bias of each word or phrase. Only the first token of a phrase is biased.
+        :param bans: The words and phrases to ban.
+        """
+        self.biases: Dict[str, float] = dict(biases or {})
+        self.bans: List[str] = list(bans or [])
+
+    def __bool__(self) -> bool:
+        return bool(self.biases) or bool(self.bans)
+
+    def __add__(self, other: 'Vocabulary') -> 'Vocabulary':
+        """
+        :return: A vocabulary with the biases and bans of both. The biases of words in both are added up.
+        """
+        biases = dict(self.biases)
+        for word, bias in other.biases.items():
+            biases[word] = biases.get(word, 0.0) + bias
+        return Vocabulary(biases, self.bans + [b for b in other.bans if b not in self.bans])
+
+    @property
+    def key(self) -> Tuple[Tuple[Tuple[str, float], ...], Tuple[str, ...]]:
+        """
+        :return: A hashable key which is equal for vocabularies with the same biases and bans.
+        """
+        return tuple(sorted(self.biases.items())), tuple(sorted(self.bans))
+
+    @staticmethod
+    def get_variants(word: str) -> List[str]:
+        """
+        :param word: A word or phrase.
+        :return: The forms of the word which are matched: as it is and capitalized, each with and without a leading
+        space.
+        """
+        forms = {word, word[:1].upper() + word[1:]}
+        return sorted({prefix + form for form in forms for prefix in ('', ' ')})
+
+    def to_dict(self) -> dict:
+        return {
+            'biases': self.biases,
+            'bans': self.bans,
+        }
+
+    def from_dict(self, d: Dict[str, Any]):
+        self.biases = dict(d.get('biases', {}))
+        self.bans = list(d.get('bans', []))
@@ -0,0 +1,209 @@
+from typing import *
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+import traceback
+
+from aiventure.common.backend import Backend, CancelToken
+from aiventure.common.metrics import Spans
+from aiventure.common.scheduler import Scheduler
+from aiventure.common.stopping import from_dict
+from aiventure.common.vocabulary import Vocabulary
+
+logger = logging.getLogger('aiventure.server')
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of a single connection to the server. Connections are kept alive between requests.
+
+    GET /info returns the model's info and limits.
+    GET /stats returns the scheduler's statistics, if requests are being batched.
+    POST /encode takes `{"text": str}` and returns `{"tokens": [int]}`.
+    POST /generate takes the arguments of `Backend.generate_candidates` as JSON, with the stopping criteria and
+    vocabulary as their `to_dict`, plus an optional `timeout` in seconds, and streams back one JSON object per
+    line: `{"chunk": str}` for every chunk of the first candidate as it is generated, then
+    `{"results": [str], "timed_out": bool, "stats": {str: float}}` once generation ends, where the stats
+    are the tokens counted and the time measured while generating, as recorded in `Spans`.
+    Closing the connection while generating cancels the generation.
+    """
+    protocol_version = 'HTTP/1.1'
+    server: 'Server'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info(format % args)
+
+    def do_GET(self) -> None:
+        if self.path == '/info':
+            backend = self.server.backend
+            self.send_json({
+                'model_info': backend.model_info,
+                'precision': backend.precision,
+                'max_positions': backend.max_positions,
+            })
+        elif self.path == '/stats' and isinstance(self.server.backend, Scheduler):
+            self.send_json(self.server.backend.stats)
+        else:
+            self.send_json({'error': f'Unknown path "{self.path}"'}, 404)
+
+    def do_POST(self) -> None:
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/encode':
+                self.send_json({'tokens': self.server.backend.encode(body['text'])})
+            elif self.path == '/generate':
+                self.generate(body)
+            else:
+                self.send_json({'error': f'Unknown path "{self.path}"'}, 404)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json({'error': f'Bad request: {e}'}, 400)
+
+    def generate(self, body: Dict[str, Any]) -> None:
+        """
+        Generates candidates, streaming the first one back as it is generated.
+        Generation runs in its own thread and only queues the lines to send, which this thread writes, so a slow
+        client never holds up the model, which may be generating for other clients at the same time.
+
+        :param body: The decoded JSON body of the request.
+        """
+        cancel_token = CancelToken(body.get('timeout'))
+        stopping_criteria = [from_dict(c) for c in body.get('stopping_criteria', [])]
+        vocabulary = Vocabulary()
+        vocabulary.from_dict(body.get('vocabulary') or {})
+        spans = Spans()
+        args = (
+            body['text'],
+            int(body.get('num_candidates', 1)),
+            int(body['max_length']),
+            int(body.get('beam_searches', 1)),
+            float(body['temperature']),
+            int(body['top_k']),
+            float(body['top_p']),
+            float(body['repetition_penalty']),
+        )
+        # The lines to send, followed by `None` once generation has ended
+        lines: 'queue.Queue[Optional[Dict[str, Any]]]' = queue.Queue()
+
+        def run() -> None:
+            try:
+                results = self.server.backend.generate_candidates(
+                    *args,
+                    callback=lambda chunk: lines.put({'chunk': chunk}),
+                    cancel_token=cancel_token,
+                    stopping_criteria=stopping_criteria,
+                    vocabulary=vocabulary,
+                    spans=spans,
+                    use_cache=bool(body.get('use_cache', True)),
+                )
+                lines.put({'results': results, 'timed_out': cancel_token.timed_out, 'stats': spans.values})
+            except Exception:
+                logger.error(traceback.format_exc())
+                lines.put({'error': 'An unexpected error occurred while generating.'})
+            lines.put(None)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        threading.Thread(target=run, name='generate', daemon=True).start()
+        ended = False
+        while not ended:
+            # the lines queued while the previous ones were being sent go out together
+            data = [lines.get()]
+            while data[-1] is not None and not lines.empty():
+                data.append(lines.get_nowait())
+            ended = data[-1] is None
+            data = b''.join(json.dumps(d).encode('utf-8') + b'\n' for d in data if d is not None)
+            try:
+                if data:
+                    self.send_chunk(data)
+                if ended:
+                    self.send_chunk(b'')
+            except (BrokenPipeError, ConnectionResetError):
+                # the client went away, so there is no point in generating any further
+                cancel_token.cancel()
+                self.close_connection = True
+                return
+
+    def send_chunk(self, data: bytes) -> None:
+        """
+        Sends a chunk of a chunked response. An empty chunk ends the response.
+
+        :param data: The data to send.
+        """
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, data: Dict[str, Any], code: int = 200) -> None:
+        """
+        Sends a complete JSON response.
+
+        :param data: The data to send.
+        :param code: The HTTP status code.
+        """
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    """
+    Serves a generation backend over HTTP, so that clients can generate text without running a model themselves.
+    """
+    daemon_threads = True
+
+    def __init__(self, backend: Backend, host: str = 'localhost', port: int = 8000):
+        """
+        :param backend: The backend to serve, usually a locally loaded `AI`.
+        :param host: The host name or address to listen on.
+        :param port: The port to listen on. 0 picks a free port.
+        """
+        super().__init__((host, port), RequestHandler)
+        self.backend: Backend = backend
+
+    @property
+    def url(self) -> str:
+        """
+        :return: The URL clients can connect to.
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def serve(
+        model_path: str,
+        host: str = 'localhost',
+        port: int = 8000,
+        precision: str = 'auto',
+        max_batch_size: int = 8,
+        batch_window: float = 0.02,
+) -> None:
+    """
+    Loads a model and serves it until interrupted.
+
+    :param model_path: The path of the model to serve.
+    :param host: The host name or address to listen on.
+    :param port: The port to listen on.
+    :param precision: The precision to load the model in.
+    :param max_batch_size: The maximum number of sequences generated in one batch. 1 or less serves requests one
+    at a time, in no particular order.
+    :param batch_window: How long to wait for more requests to batch with the first one, in seconds.
+    """
+    from aiventure.common.ai import AI
+    logger.info(f'Loading model at "{model_path}"')
+    backend = AI(model_path, precision=precision)
+    if max_batch_size > 1:
+        backend = Scheduler(backend, max_batch_size, batch_window)
+    server = Server(backend, host, port)
+    logger.info(f'Serving {server.backend.model_info} at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,305 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import *
+
+from aiventure.common.adventure import Adventure
+from aiventure.common.display import DisplayCache
+from aiventure.common.journal import Journal
+from aiventure.common.saves import SaveIndex
+
+# The story sizes, in entries, measured by default
+default_sizes = [10, 100, 1000, 10000, 100000]
+words = (
+    'the a you he she they it castle sword dragon forest village door goblin wizard gold torch river night path '
+    'walks runs looks says opens takes finds sees hears draws attacks flees whispers shouts slowly quickly '
+    'dark old small ancient quiet strange'
+).split()
+endings = ['.', '.', '.', '!', '?', ',', '']
+
+
+def make_tiny_model(path: str) -> None:
+    """
+    Saves a tiny, randomly initialized gpt-2 model with a byte-level vocabulary, which runs quickly on the cpu
+    without downloading anything.
+
+    :param path: The directory to save the model in.
+    """
+    from transformers import GPT2Config, GPT2LMHeadModel
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+    os.makedirs(path, exist_ok=True)
+    vocab = {c: i for i, c in enumerate(bytes_to_unicode().values())}
+    vocab['<|endoftext|>'] = len(vocab)
+    with open(os.path.join(path, 'vocab.json'), 'w') as vocab_file:
+        json.dump(vocab, vocab_file)
+    with open(os.path.join(path, 'merges.txt'), 'w') as merges_file:
+        merges_file.write('#version: 0.2\n')
+    config = GPT2Config(
+        vocab_size=len(vocab), n_positions=512, n_embd=64, n_layer=2, n_head=2,
+        bos_token_id=len(vocab) - 1, eos_token_id=len(vocab) - 1,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path, safe_serialization=False)
+
+
+def make_text(rng: random.Random, num_words: int) -> str:
+    """
+    :param rng: The random number generator to use.
+    :param num_words: The number of words in the text.
+    :return: A random piece of story-like text.
+    """
+    text = []
+    for _ in range(num_words):
+        text.append(rng.choice(words) + rng.choice(endings))
+    if rng.random() < 0.3:
+        text.insert(rng.randrange(len(text)), '“Hello there,” ')
+    return ' '.join(text)
+
+
+def make_adventure(size: int, seed: int = 0) -> Adventure:
+    """
+    :param size: The number of entries in the story.
+    :param seed: The seed of the random story.
+    :return: An adventure with a random story.
+    """
+    rng = random.Random(seed)
+    adventure = Adventure(f'Benchmark {size}', make_text(rng, 60))
+    adventure.memory = make_text(rng, 20)
+    for _ in range(size // 2):
+        adventure.append(make_text(rng, rng.randint(3, 12)), make_text(rng, rng.randint(20, 60)))
+    return adventure
+
+
+def measure(
+        run: Callable[[Any], Any],
+        setup: Optional[Callable[[], Any]] = None,
+        min_time: float = 0.2,
+        max_runs: int = 50,
+) -> Dict[str, float]:
+    """
+    Times a function repeatedly, until it has run for long enough or often enough.
+
+    :param run: The function to time. It is given the result of `setup`.
+    :param setup: If given, called before every run without being timed.
+    :param min_time: The total time to run for, in seconds. Slow functions still run at least once.
+    :param max_runs: The maximum number of runs.
+    :return: The median and minimum time of a run in milliseconds, and the number of runs.
+    """
+    times = []
+    while len(times) < max_runs and sum(times) < min_time:
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    return {
+        'median_ms': statistics.median(times) * 1000.0,
+        'min_ms': min(times) * 1000.0,
+        'runs': len(times),
+    }
+
+
+def bench_adventure(results: Dict[str, Dict[str, Any]], size: int, encode: Callable[[str], List[int]]) -> None:
+    adventure = make_adventure(size)
+    end = len(adventure.entries)
+    results['adventure.full_story'][size] = measure(lambda _: list(adventure.full_story))
+    results['adventure.get_ai_story'][size] = measure(lambda _: adventure.get_ai_story(max(0, end - 20), end))
+    adventure.get_ai_tokens(encode, 1024, max(0, end - 20), end)
+    results['adventure.get_ai_tokens'][size] = measure(
+        lambda _: adventure.get_ai_tokens(encode, 1024, max(0, end - 20), end)
+    )
+    results['adventure.append_revert'][size] = measure(lambda _: (adventure.append('a', 'b'), adventure.revert()))
+    query = adventure.actions[-1]
+    results['adventure.recall'][size] = measure(lambda _: adventure.recall(query, 3, max(0, end - 20)))
+
+
+def bench_filters(results: Dict[str, Dict[str, Any]], size: int, filters: Any) -> None:
+    adventure = make_adventure(size)
+    story = list(adventure.full_story)
+    rng = random.Random(size)
+    outputs = [make_text(rng, 60) for _ in range(100)]
+    results['filters.filter_output'][size] = measure(lambda _: [filters.filter_output(o) for o in outputs])
+    results['filters.filter_display'][size] = measure(lambda _: filters.filter_display(story), max_runs=10)
+    cache = DisplayCache(filters.filter_display_entry)
+    cache.render(adventure.full_story)
+
+    def render_turn(_):
+        adventure.append('You look around.', outputs[0])
+        cache.render_paragraphs(adventure.full_story)
+        adventure.revert()
+    results['display.render_turn'][size] = measure(render_turn)
+
+
+def bench_persistence(results: Dict[str, Dict[str, Any]], size: int, directory: str) -> None:
+    adventure = make_adventure(size)
+    path = os.path.join(directory, f'save_{size}')
+    journal = Journal(path)
+    index = SaveIndex(directory)
+    results['save.full'][size] = measure(lambda _: journal.compact(adventure), max_runs=10)
+
+    def save_turn(_):
+        adventure.append('You look around.', 'Nothing happens.')
+        journal.save(adventure)
+        index.update(os.path.basename(path), adventure)
+    results['save.turn'][size] = measure(save_turn)
+    results['load'][size] = measure(lambda _: Journal(path).load(Adventure()), max_runs=10)
+
+
+def bench_scanning(results: Dict[str, Dict[str, Any]], size: int, directory: str, num_saves: int) -> None:
+    # keeps the total size of the saves manageable for the largest stories
+    num_saves = max(1, min(num_saves, 200000 // max(1, size)))
+    directory = os.path.join(directory, f'saves_{size}')
+    os.makedirs(directory, exist_ok=True)
+    adventure = make_adventure(size)
+    for i in range(num_saves):
+        adventure.name = f'Save {i}'
+        Journal(os.path.join(directory, f'save_{i}')).compact(adventure)
+
+    def remove_index():
+        index = SaveIndex(directory)
+        if os.path.isfile(index.path):
+            os.remove(index.path)
+        return index
+
+    def load_all(_):
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.json'):
+                with open(entry.path, 'r') as json_file:
+                    json.load(json_file)
+    results['saves.load_all'][size] = measure(load_all, max_runs=5)
+    results['saves.scan_cold'][size] = measure(lambda index: index.scan(), remove_index, max_runs=5)
+    results['saves.scan_warm'][size] = measure(lambda _: SaveIndex(directory).scan(), max_runs=20)
+    for name in ('saves.load_all', 'saves.scan_cold', 'saves.scan_warm'):
+        results[name][size]['saves'] = num_saves
+
+
+def bench_generation(results: Dict[str, Dict[str, Any]], sizes: List[int], model_path: str) -> None:
+    from aiventure.common.ai import AI
+    ai = AI(model_path, use_gpu=False)
+    # the first pass through a model is much slower than the rest
+    ai.generate('Warming up', 8, 1, 0.8, 40, 0.9, 1.1)
+    for size in sizes:
+        adventure = make_adventure(size)
+        end = len(adventure.entries)
+        tokens = adventure.get_ai_tokens(ai.encode, ai.max_positions - 60, max(0, end - 20), end)
+
+        def generate(_):
+            ai.generate(tokens, 60, 1, 0.8, 40, 0.9, 1.1)
+        results['ai.generate_cold'][size] = measure(lambda _: generate(ai.clear_cache()), max_runs=5)
+        generate(None)
+        # retrying the last turn reuses the cached prompt
+        results['ai.generate_warm'][size] = measure(generate, max_runs=5)
+
+
+def bench_precisions(model_path: str) -> Dict[str, Dict[str, float]]:
+    """
+    :param model_path: The path of the model to compare the precisions of.
+    :return: The speed and output quality of the model in each precision, as returned by `compare_precisions`.
+    """
+    from aiventure.common.ai import compare_precisions
+    adventure = make_adventure(40)
+    return compare_precisions(model_path, ' '.join(adventure.full_story))
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    :param results: The results of this run.
+    :param baseline: The results of a previous run.
+    :param threshold: How many times slower a benchmark must get to count as a regression.
+    :return: A line describing each regression.
+    """
+    regressions = []
+    for name, sizes in results['results'].items():
+        for size, result in sizes.items():
+            old = baseline['results'].get(name, {}).get(str(size))
+            if old and old['median_ms'] > 0 and result['median_ms'] / old['median_ms'] > threshold:
+                regressions.append(
+                    f'{name} at {size} entries: {old["median_ms"]:.3f} ms -> {result["median_ms"]:.3f} ms'
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the hot paths of aiventure at several story sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='The story sizes, in entries.')
+    parser.add_argument('--output', default='benchmark.json', help='The JSON file to write the results to.')
+    parser.add_argument('--compare', help='A previous results file to check for regressions against.')
+    parser.add_argument('--threshold', type=float, default=1.25, help='The slowdown counted as a regression.')
+    parser.add_argument('--saves', type=int, default=10, help='The number of saves to scan.')
+    parser.add_argument('--skip-ai', action='store_true', help='Skips the generation benchmarks.')
+    parser.add_argument(
+        '--compare-precisions', nargs='?', const='', metavar='MODEL',
+        help='Also compares the speed and output quality of every precision, of the given model or a tiny one.',
+    )
+    args = parser.parse_args()
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user'))
+    filters = importlib.import_module('modules.aiventure.filters')
+    benchmarks = [
+        'adventure.full_story', 'adventure.get_ai_story', 'adventure.get_ai_tokens', 'adventure.append_revert',
+        'adventure.recall',
+        'filters.filter_output', 'filters.filter_display', 'display.render_turn',
+        'save.full', 'save.turn', 'load',
+        'saves.load_all', 'saves.scan_cold', 'saves.scan_warm',
+        'ai.generate_cold', 'ai.generate_warm',
+    ]
+    results = {name: {} for name in benchmarks}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            print(f'Benchmarking a story of {size} entries')
+            bench_adventure(results, size, lambda text: [ord(c) for c in text])
+            bench_filters(results, size, filters)
+            bench_persistence(results, size, directory)
+            bench_scanning(results, size, directory, args.saves)
+        if not args.skip_ai:
+            print('Benchmarking generation')
+            model_path = os.path.join(directory, 'model')
+            make_tiny_model(model_path)
+            bench_generation(results, args.sizes, model_path)
+        precisions = {}
+        if args.compare_precisions is not None:
+            print('Comparing precisions')
+            model_path = args.compare_precisions or os.path.join(directory, 'model')
+            if not os.path.isdir(model_path):
+                make_tiny_model(model_path)
+            precisions = bench_precisions(model_path)
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+        },
+        'results': {name: sizes for name, sizes in results.items() if sizes},
+    }
+    if precisions:
+        output['precisions'] = precisions
+    with open(args.output, 'w') as output_file:
+        json.dump(output, output_file, indent=4)
+
+    print(f'{"benchmark":<26}' + ''.join(f'{size:>12}' for size in args.sizes) + '  (median ms)')
+    for name, sizes in output['results'].items():
+        print(f'{name:<26}' + ''.join(f'{sizes[size]["median_ms"]:>12.3f}' for size in args.sizes if size in sizes))
+    if precisions:
+        print(f'{"precision":<26}{"prefill ms":>12}{"tokens/s":>12}{"perplexity":>12}{"agreement":>12}')
+        for precision, result in precisions.items():
+            print(
+                f'{precision:<26}{result["prefill_ms"]:>12.3f}{result["tokens_per_sec"]:>12.1f}'
+                f'{result["perplexity"]:>12.3f}{result["agreement"]:>12.3f}'
+            )
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            # sizes are strings once written to JSON
+            output = json.loads(json.dumps(output))
+            regressions = compare(output, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,18 @@
+import argparse
+import logging
+
+from aiventure.server.app import serve
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serves an aiventure AI model over HTTP.')
+    parser.add_argument('model', help='The path of the model to serve.')
+    parser.add_argument('--host', default='localhost', help='The host name or address to listen on.')
+    parser.add_argument('--port', type=int, default=8000, help='The port to listen on.')
+    parser.add_argument('--precision', default='auto', help='The precision to load the model in.')
+    parser.add_argument('--max-batch-size', type=int, default=8,
+                        help='The maximum number of sequences generated in one batch. 1 disables batching.')
+    parser.add_argument('--batch-window', type=float, default=20.0,
+                        help='How long to wait for more requests to batch together, in milliseconds.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(name)s: %(message)s')
+    serve(args.model, args.host, args.port, args.precision, args.max_batch_size, args.batch_window / 1000.0)
@@ -0,0 +1,19 @@
+import sys
+
+from aiventure.common.utils import get_import_times
+
+# Modules which should only be imported once a model is loaded
+deferred_modules = ['torch', 'transformers']
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else 'aiventure.client.app'
+    times = get_import_times(module)
+    total = max((t[2] for t in times), default=0.0)
+    print(f'Importing {module} took {total:.1f} ms')
+    print(f'{"cumulative ms":>14} {"self ms":>10}  module')
+    for name, self_time, cumulative_time in sorted(times, key=lambda t: -t[2])[:25]:
+        print(f'{cumulative_time:>14.1f} {self_time:>10.1f}  {name}')
+    imported = [m for m in deferred_modules if any(t[0] == m for t in times)]
+    if imported:
+        print(f'Warning: {", ".join(imported)} imported at startup')
+        sys.exit(1)
@@ -3,6 +3,31 @@ import re
 
 sentence_ends = [r'\.', r'\!', r'\?', r'"[^"]+"']
 quote_classes = {'"': '“”', '\'': '`’'}
+# Replaces every kind of quote with the quote of its class, in a single pass
+quote_translation = {ord(c): q for q, p in quote_classes.items() for c in p}
+white_space_pattern = re.compile(r' +')
+
+
+def get_last_quote_end(text: str) -> int:
+    """
+    Finds the end of the last complete, non-empty quotation in a given piece of text.
+
+    :param text: The text to search.
+    :return: The index after the closing quotation mark of the last quotation, or -1 if there is none.
+    """
+    end = -1
+    start = text.find('"')
+    while start != -1:
+        close = text.find('"', start + 1)
+        if close == -1:
+            break
+        if close == start + 1:
+            # an empty quotation isn't one, but its closing quotation mark may open the next one
+            start = close
+            continue
+        end = close + 1
+        start = text.find('"', end)
+    return end
 
 
 def get_last_sentence_end(text: str) -> int:
@@ -12,10 +37,10 @@ def get_last_sentence_end(text: str) -> int:
     :param text: The text to search.
     :return: The index of the last character in the last sentence end in the given text.
     """
-    end = -1
-    for e in sentence_ends:
-        p_end = [m.end() for m in re.finditer(e, text)]
-        end = max(end, p_end[-1] if len(p_end) > 0 else -1)
+    end = max(text.rfind('.'), text.rfind('!'), text.rfind('?'))
+    end = end + 1 if end != -1 else -1
+    if '"' in text:
+        end = max(end, get_last_quote_end(text))
     return end
 
 
@@ -37,10 +62,7 @@ def formalize_quotes(text: str) -> str:
     :param text: The text to process.
     :return: The processed text.
     """
-    for q, p in quote_classes.items():
-        for c in p:
-            text = re.sub(c, q, text)
-    return text
+    return text.translate(quote_translation)
 
 
 def fix_end_quote(text: str):
@@ -60,7 +82,7 @@ def clean_white_space(text: str):
     :param text: The text to process.
     :return: The processed text.
     """
-    return re.sub(r' +', ' ', text)
+    return white_space_pattern.sub(' ', text)
 
 
 def filter_input(text: str) -> str:
@@ -73,20 +95,64 @@ def filter_input(text: str) -> str:
     return text.strip()
 
 
-def filter_output(text: str) -> str:
+def finish_output(text: str) -> str:
     """
-    Default output filter.
+    Removes dangling sentences, closes quotes and cleans up whitespace, once quotes are formalized.
 
     :param text: The output to filter.
     :return: Filtered output string.
     """
-    result = formalize_quotes(text).strip()
-    result = remove_sentence_fragment(result).strip()
+    result = remove_sentence_fragment(text.strip()).strip()
     result = fix_end_quote(result).strip()
     result = clean_white_space(result).strip()
     return result
 
 
+def filter_output(text: str) -> str:
+    """
+    Default output filter.
+
+    :param text: The output to filter.
+    :return: Filtered output string.
+    """
+    return finish_output(formalize_quotes(text))
+
+
+# The stages of `filter_output`, which a filter pipeline runs instead of it, fusing the translation table with
+# those of other modules
+filter_output_stages = [quote_translation, finish_output]
+
+
+def filter_display_entry(text: str, index: int, previous: Optional[str]) -> str:
+    """
+    Default display filter for a single story entry.
+    The client caches the result for each entry, so it must only depend on the given arguments.
+
+    :param text: The entry to format.
+    :param index: The index of the entry in the story.
+    :param previous: The previous entry in the story, or `None` if this is the first entry.
+    :return: Filtered display string of the entry, including what separates it from the previous entry.
+    Items which don't end on a proper sentence will be followed by a space,
+    while items which do end in a proper sentence will be followed by a newline.
+    """
+    is_action = ((index + 1) % 2) == 0
+    story_elem = text.strip()
+    if len(story_elem) == 0:
+        return ''
+    ref = 'c'
+    if index > 0:
+        ref = 'a' if is_action else 'r'
+        ref += str(index - 1)
+    story_elem = f'[ref={ref}]{story_elem}[/ref]'
+    story_elem = f'[color=#ffff00]{story_elem}[/color]' if is_action else story_elem
+    if previous is None:
+        return story_elem
+    end = get_last_sentence_end(previous)
+    if end == len(previous):
+        return '\n\n' + story_elem
+    return ' ' + story_elem
+
+
 def filter_display(story: List[str]) -> str:
     """
     Default display filter.
@@ -96,25 +162,4 @@ def filter_display(story: List[str]) -> str:
     Items which don't end on a proper sentence will be followed by a space,
     while items which do end in a proper sentence will be followed by a newline.
     """
-    result = ''
-    for i in range(0, len(story)):
-        is_action = ((i + 1) % 2) == 0
-        h = i - 1
-        story_elem = story[i].strip()
-        if len(story_elem) == 0:
-            continue
-        ref = 'c'
-        if i > 0:
-            ref = 'a' if is_action else 'r'
-            ref += str(i - 1)
-        story_elem = f'[ref={ref}]{story_elem}[/ref]'
-        story_elem = f'[color=#ffff00]{story_elem}[/color]' if is_action else story_elem
-        if h < 0:
-            result += story_elem
-        else:
-            end = get_last_sentence_end(story[h])
-            if end == len(story[h]):
-                result += '\n\n' + story_elem
-            else:
-                result += ' ' + story_elem
-    return result
+    return ''.join(filter_display_entry(story[i], i, story[i - 1] if i > 0 else None) for i in range(len(story)))
@@ -0,0 +1,10 @@
+from typing import *
+
+from aiventure.common.stopping import RepetitionCriterion, SentenceEndCriterion, StoppingCriterion
+
+# Checked after every token the AI generates. The output filters remove everything after the last complete
+# sentence, so generating past one which is long enough only wastes time.
+stopping_criteria: List[StoppingCriterion] = [
+    SentenceEndCriterion(min_tokens=30),
+    RepetitionCriterion(ngram_size=6, max_repeats=2),
+]
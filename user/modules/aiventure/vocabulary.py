@@ -0,0 +1,14 @@
+from typing import *
+
+# Added to the AI's logits for each word or phrase while generating. Positive biases make a word more likely, and
+# negative ones less likely.
+vocabulary_biases: Dict[str, float] = {}
+
+# Words and phrases the AI can't generate at all, such as text scraped from web pages which breaks the story
+vocabulary_bans: List[str] = [
+    'Advertisement',
+    'Click here',
+    'http://',
+    'https://',
+    '[deleted]',
+]